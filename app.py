@@ -1,9 +1,12 @@
 import os
+import hashlib
 import logging
+import tempfile
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from database import normalize_database_url, engine_options, apply_sqlite_pragmas, RoutingSession, remember_writes
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -12,7 +15,7 @@ class Base(DeclarativeBase):
     pass
 
 # Initialize database
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 # Create Flask app
 app = Flask(__name__)
@@ -20,15 +23,103 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///whatsapp_clone.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_DATABASE_URI"] = normalize_database_url(os.environ.get("DATABASE_URL", "sqlite:///whatsapp_clone.db"))
+# Connection pool per worker process (pool size and timeouts apply to PostgreSQL). Keep
+# workers x (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) below the server's max_connections;
+# gunicorn.conf.py sizes its default worker count to DATABASE_MAX_CONNECTIONS (80) for this.
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+app.config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+app.config['DATABASE_POOL_TIMEOUT'] = int(os.environ.get('DATABASE_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+app.config['DATABASE_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', 300))
+# Pre-ping costs a round trip on every checkout; recycling already retires idle connections,
+# so it is off unless a proxy or failover drops connections more often than that
+app.config['DATABASE_POOL_PRE_PING'] = os.environ.get('DATABASE_POOL_PRE_PING', '0') == '1'
+# Milliseconds before PostgreSQL cancels a statement (0 disables). Migrations are exempt; run
+# other maintenance commands with DATABASE_STATEMENT_TIMEOUT=0.
+app.config['DATABASE_STATEMENT_TIMEOUT'] = int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 30000))
+# Read replica for the routes marked @replica_reads (see database.py). A client that wrote
+# within REPLICA_READ_AFTER_WRITE seconds reads from the primary, so it always sees its own
+# writes; other clients may lag behind the primary by the replication delay.
+app.config['DATABASE_REPLICA_URL'] = normalize_database_url(os.environ.get('DATABASE_REPLICA_URL'))
+app.config['REPLICA_READ_AFTER_WRITE'] = float(os.environ.get('REPLICA_READ_AFTER_WRITE', 5))
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+if app.config['DATABASE_REPLICA_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': dict(engine_options(app.config['DATABASE_REPLICA_URL'], app.config),
+                                                      url=app.config['DATABASE_REPLICA_URL'])}
+# SQLite connection pragmas (see database.py). WAL lets reads run alongside the single writer
+# instead of blocking it, and writers queue for up to busy_timeout ms rather than failing with
+# "database is locked". synchronous=NORMAL is durable in WAL mode except for the last commits
+# before a power loss. WAL needs the database on a local disk, not a network share.
+# SQLITE_TUNING=0 keeps SQLite's own defaults.
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 15000)),
+    'cache_size': -64 * 1024,  # Negative: KiB, so 64MB of page cache per connection
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+} if os.environ.get('SQLITE_TUNING', '1') != '0' else {}
 
 # File upload configuration
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+
+# Attachment delivery: 'direct' streams files through the worker (default); 'x-sendfile'
+# or 'x-accel-redirect' only authorize and let the front proxy send the bytes. For nginx:
+#   location /protected-uploads/ { internal; alias /app/uploads/; }
+app.config['FILE_SERVING_MODE'] = os.environ.get('FILE_SERVING_MODE', 'direct')
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-uploads/')
+
+# Attachment storage (see storage.py): 'local' keeps files under UPLOAD_FOLDER; 's3' uses an
+# S3-compatible bucket (AWS, MinIO, R2, ...) and redirects downloads to presigned URLs.
+# Credentials come from the standard AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY variables.
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+app.config['S3_REGION'] = os.environ.get('S3_REGION')
+app.config['S3_PRESIGN_EXPIRES'] = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+
+# Chunked uploads: per-chunk size, total size cap and where partial files live
+app.config['UPLOAD_CHUNK_SIZE'] = 5 * 1024 * 1024  # 5MB
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_SIZE', 1024 * 1024 * 1024))  # 1GB
+app.config['UPLOAD_SESSION_TTL'] = 24 * 60 * 60  # Abandoned uploads are purged after a day
+# Uploads are staged here before they move to storage; keep it on the same disk as
+# UPLOAD_FOLDER for the local backend (with S3 any writable path works, e.g. /tmp)
+app.config['UPLOAD_TMP_FOLDER'] = os.environ.get('UPLOAD_TMP_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.partial'))
+# Background jobs (see jobs.py): 'thread' runs them on a thread in each web process,
+# 'worker' leaves them to `flask run-jobs` processes, 'inline' runs them as soon as the
+# request commits (deterministic, for tests and debugging). Jobs publish realtime events, so
+# 'worker' also needs a cross-process EVENT_BUS_BACKEND (below)
+app.config['JOB_RUNNER'] = os.environ.get('JOB_RUNNER', 'thread')
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 5))
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_RETRY_DELAY'] = 10  # Seconds before the first retry, doubled after each failure
+app.config['JOB_LOCK_TIMEOUT'] = 10 * 60  # A job running longer than this is assumed lost and retried
+# Conversation membership cache for access checks (see membership.py): 'memory' keeps an LRU
+# in each process, 'redis' shares one through REDIS_URL so every worker sees invalidations
+app.config['MEMBERSHIP_CACHE_BACKEND'] = os.environ.get('MEMBERSHIP_CACHE_BACKEND', 'memory')
+app.config['MEMBERSHIP_CACHE_TTL'] = int(os.environ.get('MEMBERSHIP_CACHE_TTL', 60))
+app.config['MEMBERSHIP_CACHE_SIZE'] = 10000  # Conversations kept by the in-memory cache
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Serialized message pages and inboxes (see response_cache.py): 'memory' keeps a bounded LRU
+# in each process, 'redis' shares entries through REDIS_URL (any Redis-protocol server)
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 10000
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64MB
+app.config['RESPONSE_CACHE_TTL'] = 60 * 60  # Redis expiry for entries whose version has moved on
+# Realtime events across worker processes (see eventbus.py): 'memory' for a single process,
+# 'socket' for several workers on one host, 'postgres' (LISTEN/NOTIFY) across hosts. With
+# JOB_RUNNER=worker the `flask run-jobs` processes publish too, so the default is 'socket';
+# gunicorn.conf.py picks 'socket' for several workers as well. Use 'postgres' across hosts.
+app.config['EVENT_BUS_BACKEND'] = os.environ.get('EVENT_BUS_BACKEND', 'socket' if app.config['JOB_RUNNER'] == 'worker' else 'memory')
+# One directory per deployment (checkout and database), so separate deployments on a host
+# don't see each other's events. It must be private to the app's user (see SocketEventBus).
+deployment_id = hashlib.sha256(f"{app.root_path}\0{app.config['SQLALCHEMY_DATABASE_URI']}".encode()).hexdigest()[:16]
+app.config['EVENT_BUS_SOCKET_DIR'] = os.environ.get('EVENT_BUS_SOCKET_DIR', os.path.join(tempfile.gettempdir(), f"whatsapp-clone-events-{deployment_id}"))
+app.config['EVENT_BUS_CHANNEL'] = os.environ.get('EVENT_BUS_CHANNEL', 'chat_events')
+# Threads per process that run Flask routes when serving through asgi.py (SERVER_MODE=asgi)
+app.config['ASGI_WSGI_THREADS'] = int(os.environ.get('ASGI_WSGI_THREADS', 32))
 app.config['ALLOWED_EXTENSIONS'] = {
     'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'tiff', 'psd', 'ai', 'eps',
     'mp3', 'wav', 'ogg', 'm4a', 'aac', 'flac', 'wma',
@@ -42,18 +133,27 @@ app.config['ALLOWED_EXTENSIONS'] = {
 
 # Initialize database with app
 db.init_app(app)
+app.after_request(remember_writes)
 
-# Ensure upload directory exists
+# Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_TMP_FOLDER'], exist_ok=True)
 
-# Create tables
+# Create tables and apply pending schema migrations (see migrations.py). gunicorn.conf.py
+# preloads the app, so this runs once in the master; other multi-process setups should
+# set AUTO_MIGRATE=0 and run `flask migrate` once before starting the workers.
+app.config['AUTO_MIGRATE'] = os.environ.get('AUTO_MIGRATE', '1') != '0'
 with app.app_context():
+    apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
     import models  # noqa: F401
-    db.create_all()
+    from migrations import migrate
+    if app.config['AUTO_MIGRATE']:
+        migrate()
     logging.info("Database tables created")
 
 # Import routes
 import routes  # noqa: F401
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,156 @@
+import json
+import asyncio
+import logging
+from http.cookies import SimpleCookie
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from app import app, db
+from realtime import broker, format_sse, AsyncListener
+from presence import presence, stream_heartbeat
+from routes import EVENT_STREAM_KEEPALIVE, CHANGE_EVENTS, wait_request_options, changed_versions
+
+# ASGI entry point (SERVER_MODE=asgi in gunicorn.conf.py, or `uvicorn asgi:application`).
+# Event streams and long polls are served directly on the event loop, so an idle
+# connection costs a coroutine instead of a thread; every other route runs the Flask
+# app on a thread pool of ASGI_WSGI_THREADS per process.
+
+# Larger /api/wait bodies are rejected; a version map for thousands of conversations fits
+MAX_WAIT_BODY_SIZE = 1024 * 1024
+
+flask_application = WSGIMiddleware(app, workers=app.config['ASGI_WSGI_THREADS'])
+
+def session_user_id(scope):
+    """The logged-in user from Flask's signed session cookie, or None"""
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+async def send_json(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def event_stream(scope, receive, send):
+    """Async twin of the /api/events route"""
+    user_id = session_user_id(scope)
+    if user_id is None:
+        await send_json(send, 401, b'{"message": "Not authenticated", "success": false}')
+        return
+
+    loop = asyncio.get_running_loop()
+    listener = broker.subscribe(user_id, AsyncListener(loop, broker.max_queue_size))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        # Ask the browser to reconnect quickly if the stream drops
+        chunk = "retry: 3000\n\n"
+        while True:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            next_event = asyncio.ensure_future(listener.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=EVENT_STREAM_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if listener.overflowed:
+                # Events were dropped; ending the stream makes EventSource reconnect and resync
+                next_event.cancel()
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+            if next_event in done:
+                chunk = format_sse(*next_event.result())
+                continue
+            next_event.cancel()
+            if disconnected in done:
+                break
+            # An open stream keeps the user's presence alive; publishing it blocks on the event bus
+            if presence.stream_heartbeat_due(user_id, EVENT_STREAM_KEEPALIVE):
+                await loop.run_in_executor(None, stream_heartbeat, user_id)
+            chunk = ": keep-alive\n\n"
+    except OSError as e:
+        logging.debug(f"Event stream for {user_id} closed: {e}")
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(user_id, listener)
+
+async def read_body(receive, max_size):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > max_size:
+            raise ValueError('Request body too large')
+        if not message.get('more_body'):
+            return body
+
+def current_changes(user_id, known_versions):
+    # Runs on an executor thread, outside any request
+    with app.app_context():
+        try:
+            return changed_versions(user_id, known_versions)
+        finally:
+            db.session.remove()
+
+async def wait_for_changes(scope, receive, send):
+    """Async twin of the /api/wait route"""
+    user_id = session_user_id(scope)
+    if user_id is None:
+        await send_json(send, 200, b'{"message": "Not authenticated", "success": false}')
+        return
+
+    try:
+        known_versions, timeout = wait_request_options(json.loads(await read_body(receive, MAX_WAIT_BODY_SIZE) or b'{}'))
+    except ValueError as e:
+        await send_json(send, 200, json.dumps({'message': str(e), 'success': False}).encode())
+        return
+
+    loop = asyncio.get_running_loop()
+    # Subscribe before the first check so a change between the two isn't missed
+    listener = broker.subscribe(user_id, AsyncListener(loop, broker.max_queue_size))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        deadline = loop.time() + timeout
+        changed = await loop.run_in_executor(None, current_changes, user_id, known_versions)
+        while not changed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            next_event = asyncio.ensure_future(listener.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=remaining,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if next_event not in done:
+                next_event.cancel()
+                if disconnected in done:
+                    return
+                break
+            event, _ = next_event.result()
+            if event in CHANGE_EVENTS:
+                changed = await loop.run_in_executor(None, current_changes, user_id, known_versions)
+        await send_json(send, 200, json.dumps({'changed': changed, 'success': True}).encode())
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(user_id, listener)
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/events':
+        await event_stream(scope, receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/api/wait':
+        await wait_for_changes(scope, receive, send)
+        return
+    await flask_application(scope, receive, send)
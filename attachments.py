@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import subprocess
+from datetime import datetime
+from app import db
+from models import Message
+from jobs import job
+from summaries import bump_version
+from membership import conversation_member_ids
+from realtime import broker
+from storage import storage
+from thumbnails import thumbnails_supported, generate_thumbnails
+
+def probe_audio_duration(key):
+    """Duration in seconds read with ffprobe, or None when ffprobe is unavailable or unsure"""
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+
+    with tempfile.NamedTemporaryFile() as local_copy:
+        path = storage.local_path(key)
+        if path is None:
+            with storage.open(key) as source:
+                shutil.copyfileobj(source, local_copy)
+            local_copy.flush()
+            path = local_copy.name
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=60
+        )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None  # e.g. "N/A" for streamed WebM without a duration header
+
+@job('process_attachment')
+def process_attachment(message_id):
+    """Post-upload work for an attachment message, recorded on the message row"""
+    message = db.session.get(Message, message_id)
+    if message is None or not message.file_path:
+        return
+
+    if message.message_type == 'image' and thumbnails_supported(message.file_type, message.file_size):
+        message.image_width, message.image_height = generate_thumbnails(message.file_path)
+    elif message.message_type == 'audio' and not message.audio_duration:
+        message.audio_duration = probe_audio_duration(message.file_path) or message.audio_duration
+
+    message.processed_at = datetime.utcnow()
+    # Cached pages carry the image dimensions and audio duration
+    bump_version(message.conversation_id)
+    db.session.commit()
+
+    # Open pages and long polls pick up the new details
+    broker.publish(conversation_member_ids(message.conversation_id), 'message_updated', {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'image_width': message.image_width,
+        'image_height': message.image_height,
+        'audio_duration': message.audio_duration
+    })
@@ -0,0 +1,117 @@
+"""Latency of realtime fan-out to groups through the cross-worker event bus.
+
+    python benchmarks/fanout.py [--backend socket] [--processes 4] [--group-sizes 2,10,100,1000] [--events 200]
+
+Forks --processes receiver processes that each subscribe a share of the group
+members (member i lives in process i % processes), then publishes --events
+events per group size from the parent, the way a worker handling
+api_send_message would. Prints delivered/expected counts, the publisher's cost
+per event and delivery latency percentiles measured at the listeners.
+
+--backend postgres needs a PostgreSQL --database-url; memory keeps every
+listener in the publishing process, as a single worker does.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--backend', choices=['memory', 'socket', 'postgres'], default='socket')
+parser.add_argument('--processes', type=int, default=4)
+parser.add_argument('--group-sizes', default='2,10,100,1000')
+parser.add_argument('--events', type=int, default=200)
+parser.add_argument('--interval', type=float, default=0.002, help='seconds between published events')
+parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+args = parser.parse_args()
+
+database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(database_dir, 'bench.db')}"
+os.environ['EVENT_BUS_BACKEND'] = args.backend
+os.environ['EVENT_BUS_SOCKET_DIR'] = os.path.join(database_dir, 'events')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+logging.disable(logging.INFO)
+
+from app import app, db  # noqa: E402
+from realtime import broker  # noqa: E402
+import eventbus  # noqa: E402,F401
+
+class Recorder:
+    """Listener that keeps the delivery latency of every event instead of queueing it"""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    def put_nowait(self, item):
+        _, data = item
+        self.latencies.setdefault(data['group'], []).append(time.monotonic() - data['sent_at'])
+
+def subscribe_members(members, latencies):
+    for user_id in members:
+        broker.subscribe(user_id, Recorder(latencies))
+
+def receiver(connection, members):
+    # Like gunicorn's post_fork: don't share the parent's pooled connections
+    with app.app_context():
+        db.engine.dispose(close=False)
+    latencies = {}
+    subscribe_members(members, latencies)
+    connection.send('ready')
+    while connection.recv() == 'report':
+        connection.send(latencies)
+        latencies.clear()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    group_sizes = [int(size) for size in args.group_sizes.split(',')]
+    processes = 0 if args.backend == 'memory' else args.processes
+    members = range(max(group_sizes))
+
+    local_latencies = {}
+    if processes == 0:
+        subscribe_members(members, local_latencies)
+    context = multiprocessing.get_context('fork')
+    connections = []
+    for index in range(processes):
+        parent_end, child_end = context.Pipe()
+        context.Process(target=receiver, args=(child_end, members[index::processes]), daemon=True).start()
+        connections.append(parent_end)
+    for connection in connections:
+        connection.recv()
+    time.sleep(1)  # Let the receivers bind their sockets / LISTEN
+
+    print(f"backend={args.backend} receiver processes={processes} events per group={args.events}")
+    print(f"{'group':>6} {'delivered':>16} {'publish ms':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for size in group_sizes:
+        user_ids = list(range(size))
+        publish_time = 0
+        for _ in range(args.events):
+            started = time.monotonic()
+            broker.publish(user_ids, 'new_message', {'sent_at': started, 'group': size})
+            publish_time += time.monotonic() - started
+            time.sleep(args.interval)
+        time.sleep(1)  # Drain in-flight events
+
+        latencies = local_latencies.pop(size, [])
+        for connection in connections:
+            connection.send('report')
+            latencies += connection.recv().get(size, [])
+        latencies.sort()
+        expected = size * args.events
+        if not latencies:
+            print(f"{size:>6} {0:>7} / {expected:<7}")
+            continue
+        print(f"{size:>6} {len(latencies):>7} / {expected:<7} {publish_time / args.events * 1000:>11.3f} "
+              + ' '.join(f"{percentile(latencies, fraction) * 1000:>8.3f}" for fraction in (0.5, 0.95, 0.99, 1)))
+
+    for connection in connections:
+        connection.send('stop')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Query plans and timings for the hot route queries, without and with the migration indexes.
+
+    python benchmarks/query_plans.py [--users 2000] [--conversations 6000] [--messages 200000]
+
+Builds a synthetic chat database in a temporary SQLite file, drops the
+secondary indexes added by migrations 4, 6 and 8, and prints EXPLAIN QUERY PLAN
+output plus average latency for each query; then recreates the indexes and
+prints the same again.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(database_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+logging.disable(logging.INFO)
+
+from sqlalchemy import text  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User, Conversation, ConversationParticipant, Message, UploadSession  # noqa: E402
+from migrations import create_index  # noqa: E402
+
+INDEXES = [
+    (Message, 'ix_messages_conversation_timestamp_id'),
+    (Message, 'ix_messages_file_path'),
+    (Message, 'ix_messages_sender_id'),
+    (ConversationParticipant, 'uq_conversation_participants_conversation_user'),
+    (ConversationParticipant, 'ix_conversation_participants_user_conversation'),
+    (UploadSession, 'ix_upload_sessions_updated_at'),
+]
+
+# Hand-written equivalents of the statements behind the busiest routes
+QUERIES = [
+    ('participant check (every route)',
+     "SELECT id FROM conversation_participants WHERE conversation_id = :conversation_id AND user_id = :user_id LIMIT 1"),
+    ('my conversations (inbox, search, statuses)',
+     "SELECT conversation_id FROM conversation_participants WHERE user_id = :user_id"),
+    ('latest message page (api_messages)',
+     "SELECT id, timestamp FROM messages WHERE conversation_id = :conversation_id "
+     "ORDER BY timestamp DESC, id DESC LIMIT 51"),
+    ('unread recount (mark_seen)',
+     "SELECT count(id) FROM messages WHERE conversation_id = :conversation_id "
+     "AND sender_id != :user_id AND timestamp > :since"),
+    ('own messages for ticks (message_statuses)',
+     "SELECT id FROM messages WHERE sender_id = :user_id AND conversation_id IN "
+     "(SELECT conversation_id FROM conversation_participants WHERE user_id = :user_id)"),
+    ('blob references (gc-blobs, migrate-blobs)',
+     "SELECT count(id) FROM messages WHERE file_path = :file_path"),
+    ('stale uploads (upload init)',
+     "SELECT id FROM upload_sessions WHERE updated_at < :cutoff"),
+]
+
+def populate(user_count, conversation_count, message_count):
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    user_ids = [f"user-{i:06d}" for i in range(user_count)]
+    db.session.execute(User.__table__.insert(), [
+        {'user_id': user_id, 'unique_id': f"U{i:07d}", 'name': user_id, 'email': f"{user_id}@example.com"}
+        for i, user_id in enumerate(user_ids)
+    ])
+
+    conversations, participants = [], []
+    for i in range(conversation_count):
+        conversation_id = f"conv-{i:06d}"
+        # Mostly private chats, some groups
+        members = rng.sample(user_ids, 2 if rng.random() < 0.85 else rng.randint(3, 30))
+        conversations.append({'id': conversation_id, 'name': conversation_id,
+                              'type': 'private' if len(members) == 2 else 'group',
+                              'created_by': members[0], 'created_at': start})
+        participants.extend({'conversation_id': conversation_id, 'user_id': user_id} for user_id in members)
+    db.session.execute(Conversation.__table__.insert(), conversations)
+    db.session.execute(ConversationParticipant.__table__.insert(), participants)
+
+    members_by_conversation = {}
+    for participant in participants:
+        members_by_conversation.setdefault(participant['conversation_id'], []).append(participant['user_id'])
+    messages = []
+    for i in range(message_count):
+        conversation = conversations[int(rng.paretovariate(1.2)) % conversation_count]
+        is_file = rng.random() < 0.05
+        messages.append({
+            'id': f"msg-{i:08d}",
+            'conversation_id': conversation['id'],
+            'sender_id': rng.choice(members_by_conversation[conversation['id']]),
+            'content': f"message {i}",
+            'message_type': 'file' if is_file else 'text',
+            'file_path': f"blobs/{i % 97:02x}/{i:08d}" if is_file else None,
+            'timestamp': start + timedelta(seconds=i * 7)
+        })
+    for offset in range(0, len(messages), 10000):
+        db.session.execute(Message.__table__.insert(), messages[offset:offset + 10000])
+
+    db.session.execute(UploadSession.__table__.insert(), [
+        {'id': f"upload-{i:05d}", 'user_id': rng.choice(user_ids), 'conversation_id': conversations[0]['id'],
+         'file_name': 'f.bin', 'file_size': 1, 'updated_at': start + timedelta(minutes=i)}
+        for i in range(2000)
+    ])
+    db.session.commit()
+    return conversations, participants, messages
+
+def query_params(conversations, participants, messages):
+    busiest = conversations[1]['id']
+    member = next(p['user_id'] for p in participants if p['conversation_id'] == busiest)
+    return {
+        'conversation_id': busiest,
+        'user_id': member,
+        'since': messages[len(messages) // 2]['timestamp'],
+        'file_path': next(m['file_path'] for m in messages if m['file_path']),
+        'cutoff': datetime(2025, 1, 1, 2)
+    }
+
+def report(label, params, repeat):
+    print(f"\n=== {label} ===")
+    for name, sql in QUERIES:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            db.session.execute(text(sql), params).all()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+        # Planned after running: EXPLAIN alone doesn't notice another connection's schema change
+        plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+        print(f"{name:<45} {elapsed_ms:9.3f} ms")
+        for row in plan:
+            print(f"    {row[-1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--conversations', type=int, default=6000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Populating {args.users} users, {args.conversations} conversations, {args.messages} messages...")
+        params = query_params(*populate(args.users, args.conversations, args.messages))
+
+        for _, index_name in INDEXES:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        report('Before: no secondary indexes', params, args.repeat)
+
+        for model, index_name in INDEXES:
+            create_index(model, index_name)
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        report('After: migration indexes', params, args.repeat)
+
+if __name__ == '__main__':
+    main()
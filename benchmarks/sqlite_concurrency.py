@@ -0,0 +1,173 @@
+"""Mixed read/write load on SQLite with the tuned connection pragmas and with SQLite's defaults.
+
+    python benchmarks/sqlite_concurrency.py [--processes 4] [--threads 16] [--seconds 10] [--write-ratio 0.5]
+
+Runs the benchmark once per profile (--profile both), each in a fresh process
+and a fresh temporary database: SQLITE_TUNING=0 for the defaults (rollback
+journal, synchronous=FULL, the driver's 5s busy timeout) and the
+SQLITE_PRAGMAS from app.py for the tuned profile. Every worker thread is a
+logged-in user driving the real routes through the test client: inbox and
+message page reads, sends and mark-seen writes. Prints throughput, failed
+requests (mostly "database is locked") and latency percentiles per route.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--profile', choices=['both', 'default', 'tuned'], default='both')
+parser.add_argument('--processes', type=int, default=4, help='like gunicorn workers')
+parser.add_argument('--threads', type=int, default=16, help='concurrent users per process')
+parser.add_argument('--seconds', type=float, default=10)
+parser.add_argument('--write-ratio', type=float, default=0.5)
+parser.add_argument('--users', type=int, default=500)
+parser.add_argument('--conversations', type=int, default=1000)
+parser.add_argument('--messages', type=int, default=50000)
+args = parser.parse_args()
+
+if args.profile == 'both':
+    for profile in ('default', 'tuned'):
+        subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--profile', profile], check=True)
+    sys.exit()
+
+database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(database_dir, 'bench.db')}"
+os.environ['SQLITE_TUNING'] = '1' if args.profile == 'tuned' else '0'
+os.environ['JOB_RUNNER'] = 'inline'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+logging.disable(logging.CRITICAL)
+
+from app import app, db  # noqa: E402
+from models import User, Conversation, ConversationParticipant, Message  # noqa: E402
+from summaries import rebuild_summaries  # noqa: E402
+
+def populate(user_count, conversation_count, message_count):
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=30)
+    user_ids = [f"user-{i:06d}" for i in range(user_count)]
+    db.session.execute(User.__table__.insert(), [
+        {'user_id': user_id, 'unique_id': f"U{i:07d}", 'name': user_id, 'email': f"{user_id}@example.com"}
+        for i, user_id in enumerate(user_ids)
+    ])
+    conversations = {}
+    for i in range(conversation_count):
+        members = rng.sample(user_ids, 2 if rng.random() < 0.85 else rng.randint(3, 30))
+        conversations[f"conv-{i:06d}"] = members
+    db.session.execute(Conversation.__table__.insert(), [
+        {'id': conversation_id, 'name': conversation_id, 'type': 'private' if len(members) == 2 else 'group',
+         'created_by': members[0], 'created_at': start}
+        for conversation_id, members in conversations.items()
+    ])
+    db.session.execute(ConversationParticipant.__table__.insert(), [
+        {'conversation_id': conversation_id, 'user_id': user_id}
+        for conversation_id, members in conversations.items() for user_id in members
+    ])
+    conversation_ids = list(conversations)
+    messages = []
+    for i in range(message_count):
+        conversation_id = rng.choice(conversation_ids)
+        messages.append({'id': f"msg-{i:08d}", 'conversation_id': conversation_id,
+                         'sender_id': rng.choice(conversations[conversation_id]),
+                         'content': f"message {i}", 'timestamp': start + timedelta(seconds=i * 30)})
+    for offset in range(0, len(messages), 10000):
+        db.session.execute(Message.__table__.insert(), messages[offset:offset + 10000])
+    db.session.commit()
+    rebuild_summaries()
+    return conversations
+
+def user_session(user_id, conversation_ids, deadline, write_ratio, results):
+    rng = random.Random(user_id)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    unseen = []
+    while time.monotonic() < deadline:
+        conversation_id = rng.choice(conversation_ids)
+        if rng.random() < write_ratio:
+            if unseen and rng.random() < 0.4:
+                route = 'mark_seen'
+                request = lambda: client.post('/api/mark_seen', json={'message_ids': unseen[-20:]})
+            else:
+                route = 'send_message'
+                request = lambda: client.post('/api/send_message', json={'conversation_id': conversation_id,
+                                                                           'content': 'benchmark'})
+        elif rng.random() < 0.5:
+            route = 'conversations'
+            request = lambda: client.get('/api/conversations')
+        else:
+            route = 'messages'
+            request = lambda: client.get(f"/api/messages/{conversation_id}")
+        started = time.monotonic()
+        response = request()
+        elapsed = time.monotonic() - started
+        ok = response.status_code == 200 and response.get_json().get('success', True)
+        results.append((route, ok, elapsed))
+        if route == 'mark_seen':
+            unseen.clear()
+        elif route == 'messages' and ok:
+            unseen.extend(message['id'] for message in response.get_json()['messages']
+                          if message['sender_id'] != user_id)
+
+def worker(users, conversations_by_user, deadline, write_ratio, queue):
+    # Like gunicorn's post_fork: don't share the parent's pooled connections
+    with app.app_context():
+        db.engine.dispose(close=False)
+    results = []
+    threads = [threading.Thread(target=user_session,
+                                args=(user_id, conversations_by_user[user_id], deadline, write_ratio, results))
+               for user_id in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    with app.app_context():
+        conversations = populate(args.users, args.conversations, args.messages)
+        pragmas = ', '.join(f"{name}={value}" for name, value in app.config['SQLITE_PRAGMAS'].items()) or 'SQLite defaults'
+    conversations_by_user = {}
+    for conversation_id, members in conversations.items():
+        for user_id in members:
+            conversations_by_user.setdefault(user_id, []).append(conversation_id)
+    users = random.Random(7).sample(sorted(conversations_by_user), args.processes * args.threads)
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    deadline = time.monotonic() + args.seconds
+    processes = [context.Process(target=worker, args=(users[index::args.processes], conversations_by_user,
+                                                      deadline, args.write_ratio, queue))
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    results = [result for _ in processes for result in queue.get()]
+    for process in processes:
+        process.join()
+
+    print(f"\n=== {args.profile}: {pragmas} ===")
+    print(f"{args.processes} processes x {args.threads} threads, {args.seconds:g}s, write ratio {args.write_ratio:g}")
+    print(f"{'route':<15} {'requests':>9} {'failed':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>9}")
+    for route in ('conversations', 'messages', 'send_message', 'mark_seen', 'all'):
+        rows = [row for row in results if route in ('all', row[0])]
+        if not rows:
+            continue
+        latencies = sorted(elapsed for _, _, elapsed in rows)
+        failed = sum(1 for _, ok, _ in rows if not ok)
+        print(f"{route:<15} {len(rows):>9} {failed:>7} {len(rows) / args.seconds:>8.1f} "
+              + ' '.join(f"{percentile(latencies, fraction) * 1000:>8.1f}" for fraction in (0.5, 0.95, 0.99))
+              + f" {latencies[-1] * 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+import time
+import uuid
+import fcntl
+import hashlib
+import contextlib
+import click
+from app import app, db
+from models import Message
+from storage import storage
+
+# Attachments are stored once per distinct content under the storage key
+# blobs/ab/cd/<sha256>; Message.file_path holds that key, so the messages
+# pointing at a blob are its references.
+BLOB_DIR = 'blobs'
+BLOB_BLOCK_SIZE = 64 * 1024
+# Unreferenced blobs younger than this survive GC: their message may not be committed yet
+BLOB_GC_GRACE = 60 * 60
+
+@contextlib.contextmanager
+def blob_lock(exclusive):
+    """Host-wide lock: uploads hold it shared while they reuse or add a blob, GC exclusively to delete one"""
+    with open(os.path.join(app.config['UPLOAD_TMP_FOLDER'], '.blob.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def blob_key(digest):
+    return '/'.join((BLOB_DIR, digest[:2], digest[2:4], digest))
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(BLOB_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def commit_blob(temp_path, digest, keep_source=False):
+    """Move a fully written temp file to its content address; returns the key.
+
+    If the content is already stored the temp file is dropped instead, so
+    concurrent uploads of the same bytes converge on one blob. With
+    keep_source the file is copied and left in place either way.
+    """
+    key = blob_key(digest)
+    with blob_lock(exclusive=False):
+        try:
+            storage.touch(key)  # Already stored: restart its GC grace period
+            if not keep_source:
+                os.remove(temp_path)
+        except FileNotFoundError:
+            storage.put_file(key, temp_path, keep_source=keep_source)
+    return key
+
+def store_stream(stream):
+    """Save an upload stream, hashing it on the way to disk; returns (key, size)"""
+    temp_path = os.path.join(app.config['UPLOAD_TMP_FOLDER'], f"{uuid.uuid4()}.blob")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as temp:
+            for block in iter(lambda: stream.read(BLOB_BLOCK_SIZE), b''):
+                digest.update(block)
+                temp.write(block)
+                size += len(block)
+        return commit_blob(temp_path, digest.hexdigest()), size
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_file(path, keep_source=False):
+    """Move (or with keep_source, copy) an already complete file, e.g. an assembled chunked upload, into the store"""
+    return commit_blob(path, file_digest(path), keep_source)
+
+def gc_blobs():
+    """Delete blobs no message references any more, with their thumbnails; returns how many were removed"""
+    from thumbnails import delete_thumbnails  # thumbnails.py imports this module
+    referenced = {file_path for (file_path,) in db.session.query(Message.file_path).filter(
+        Message.file_path.like(f"{BLOB_DIR}/%")
+    ).distinct()}
+    cutoff = time.time() - BLOB_GC_GRACE
+    removed = 0
+    for key, modified_at in list(storage.list(BLOB_DIR)):
+        if key in referenced or modified_at >= cutoff:
+            continue
+        # The listing is stale by now: an upload of the same content may have touched the
+        # blob and committed its message since. Re-check both, with uploads held off.
+        with blob_lock(exclusive=True):
+            modified_at = storage.modified_at(key)
+            if modified_at is None or modified_at >= cutoff:
+                continue
+            db.session.rollback()  # Start a fresh transaction to see newly committed messages
+            if Message.query.filter_by(file_path=key).first() is not None:
+                continue
+            storage.delete(key)
+            delete_thumbnails(key)
+        removed += 1
+    return removed
+
+@app.cli.command('gc-blobs')
+def gc_blobs_command():
+    """Remove attachment blobs that are no longer referenced by any message."""
+    click.echo(f"Removed {gc_blobs()} unreferenced blobs")
+
+def migrate_blobs():
+    """Move legacy name-based uploads from UPLOAD_FOLDER into the blob store and repoint their messages.
+
+    Blobs are copied (hard-linked locally) in before the database commit and
+    the old files are only deleted after it, so an interrupted run leaves
+    every message readable.
+    Returns (migrated paths, missing paths).
+    """
+    legacy_paths = [file_path for (file_path,) in db.session.query(Message.file_path).filter(
+        Message.file_path.isnot(None),
+        ~Message.file_path.like(f"{BLOB_DIR}/%")
+    ).distinct()]
+
+    migrated, missing = [], []
+    for legacy_path in legacy_paths:
+        source = os.path.join(app.config['UPLOAD_FOLDER'], legacy_path)
+        if not os.path.isfile(source):
+            missing.append(legacy_path)
+            continue
+
+        key = blob_key(file_digest(source))
+        if not storage.exists(key):
+            storage.put_file(key, source, keep_source=True)
+
+        Message.query.filter_by(file_path=legacy_path).update(
+            {Message.file_path: key}, synchronize_session=False
+        )
+        migrated.append(legacy_path)
+
+    db.session.commit()
+
+    for legacy_path in migrated:
+        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], legacy_path))
+    return migrated, missing
+
+@app.cli.command('migrate-blobs')
+def migrate_blobs_command():
+    """Move existing uploads into content-addressed storage, deduplicating identical files."""
+    migrated, missing = migrate_blobs()
+    click.echo(f"Migrated {len(migrated)} files into the blob store")
+    for legacy_path in missing:
+        click.echo(f"Missing on disk, left unchanged: {legacy_path}")
@@ -0,0 +1,78 @@
+import time
+import functools
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.expression import UpdateBase
+
+# Engine-level database setup that depends on the backend in DATABASE_URL, and
+# read/write routing: routes marked @replica_reads send their queries to
+# DATABASE_REPLICA_URL, everything else (and every write) uses the primary.
+
+def normalize_database_url(url):
+    """Map postgres:// and driverless postgresql:// URLs to the psycopg2 driver we install"""
+    if not url:
+        return url
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    if url.startswith('postgresql://'):
+        url = 'postgresql+psycopg2://' + url[len('postgresql://'):]
+    return url
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the primary and replica engines"""
+    options = {
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+    }
+    if make_url(url).get_backend_name() == 'postgresql':
+        options['pool_size'] = config['DATABASE_POOL_SIZE']
+        options['max_overflow'] = config['DATABASE_MAX_OVERFLOW']
+        options['pool_timeout'] = config['DATABASE_POOL_TIMEOUT']
+        if config['DATABASE_STATEMENT_TIMEOUT']:
+            options['connect_args'] = {'options': f"-c statement_timeout={config['DATABASE_STATEMENT_TIMEOUT']}"}
+    return options
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run the SQLITE_PRAGMAS on every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # Outside a transaction: journal_mode can't change inside one
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+class RoutingSession(Session):
+    """Session that reads from the 'replica' bind inside @replica_reads routes"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if has_request_context():
+            if writing:
+                g.database_written = True
+            elif bind is None and g.get('replica_reads'):
+                return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def replica_reads(view):
+    """Serve a read-only route from the replica, unless this client wrote very recently"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config['DATABASE_REPLICA_URL']:
+            # Read-your-writes: the replica may not have caught up with this client's last write yet
+            g.replica_reads = time.time() - session.get('last_write_at', 0) > current_app.config['REPLICA_READ_AFTER_WRITE']
+        return view(*args, **kwargs)
+    return wrapper
+
+def remember_writes(response):
+    """after_request hook: note when this client last wrote, for replica_reads()"""
+    if g.get('database_written') and current_app.config['DATABASE_REPLICA_URL']:
+        session['last_write_at'] = time.time()
+    return response
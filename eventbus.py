@@ -0,0 +1,236 @@
+import os
+import json
+import glob
+import time
+import stat
+import uuid
+import socket
+import select
+import logging
+import itertools
+import threading
+from sqlalchemy import text
+from app import app, db
+from realtime import broker
+
+# Cross-process event bus behind EventBroker.publish(). Every process delivers its
+# own events locally, then sends them here; the bus hands events from other
+# processes to the local broker. EVENT_BUS_BACKEND picks the transport:
+#   memory   - nothing leaves the process (a single worker)
+#   socket   - Unix datagram sockets in EVENT_BUS_SOCKET_DIR (several workers, one host)
+#   postgres - LISTEN/NOTIFY on the application database (several hosts)
+#
+# Events travel as JSON frames "<origin>:<message id>:<index>:<count>:<piece>";
+# messages larger than a backend's frame size are split and reassembled.
+
+# Partially received split messages kept before the oldest is dropped
+MAX_PARTIAL_MESSAGES = 1000
+
+# Seconds a socket send waits for a busy receiver (the kernel queues only a few datagrams)
+SOCKET_SEND_TIMEOUT = 0.25
+
+class EventBus:
+    """Framing, reassembly and the receiver thread shared by the transports"""
+
+    max_frame_size = None
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self._message_ids = itertools.count()
+        self._partial = {}
+        self._lock = threading.Lock()
+        self._origin = None
+        self._origin_pid = None
+        self._receiver = None
+        self._receiver_pid = None
+
+    @property
+    def origin(self):
+        # Unique per process, including forked workers, so senders can skip their own frames
+        if self._origin_pid != os.getpid():
+            self._origin_pid = os.getpid()
+            self._origin = uuid.uuid4().hex
+        return self._origin
+
+    def publish(self, user_ids, event, data):
+        """Send an event to the other processes; failures are logged, never raised"""
+        # ASCII-only JSON, so frames can be cut at any character
+        message = json.dumps({'users': user_ids, 'event': event, 'data': data})
+        piece_size = self.max_frame_size - 100
+        pieces = [message[start:start + piece_size] for start in range(0, len(message), piece_size)]
+        message_id = next(self._message_ids)
+        frames = [f"{self.origin}:{message_id}:{index}:{len(pieces)}:{piece}" for index, piece in enumerate(pieces)]
+        try:
+            self.send(frames)
+        except Exception as e:
+            logging.error(f"Event bus publish failed for {event}: {e}")
+
+    def received(self, frame):
+        """Handle one frame from the transport"""
+        origin, message_id, index, count, piece = frame.split(':', 4)
+        if origin == self.origin:
+            return
+        if count != '1':
+            with self._lock:
+                parts = self._partial.setdefault((origin, message_id), {})
+                parts[int(index)] = piece
+                if len(parts) < int(count):
+                    if len(self._partial) > MAX_PARTIAL_MESSAGES:
+                        # Lost frames never complete; forget the oldest message
+                        del self._partial[next(iter(self._partial))]
+                    return
+                del self._partial[(origin, message_id)]
+            piece = ''.join(parts[i] for i in range(int(count)))
+        message = json.loads(piece)
+        self.deliver(message['users'], message['event'], message['data'])
+
+    def start(self):
+        """Start receiving in this process (lazily, and again after a fork)"""
+        if self._receiver is not None and self._receiver_pid == os.getpid():
+            return
+        with self._lock:
+            if self._receiver is not None and self._receiver_pid == os.getpid():
+                return
+            self._receiver_pid = os.getpid()
+            self._receiver = threading.Thread(target=self._run, name='event-bus', daemon=True)
+            self._receiver.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.receive_forever()
+            except Exception as e:
+                logging.error(f"Event bus receiver failed, reconnecting: {e}")
+                time.sleep(1)
+
+    def send(self, frames):
+        raise NotImplementedError
+
+    def receive_forever(self):
+        raise NotImplementedError
+
+class InProcessEventBus(EventBus):
+    """Single process: the broker's local delivery is all there is"""
+
+    def publish(self, user_ids, event, data):
+        pass
+
+    def start(self):
+        pass
+
+class SocketEventBus(EventBus):
+    """Unix datagram socket per receiving process; senders write to every socket in the directory"""
+
+    max_frame_size = 60 * 1024
+
+    def __init__(self, deliver, directory):
+        super().__init__(deliver)
+        self.directory = directory
+        self._sender = None
+        self._sender_pid = None
+
+    def socket_path(self, origin):
+        return os.path.join(self.directory, f"{origin}.sock")
+
+    def check_directory(self):
+        """Create the socket directory, or make sure an existing one is private to this user"""
+        # Anyone who can write there can inject events, and anyone who can bind there receives them
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise RuntimeError(f"Event bus directory {self.directory} must be a directory owned by "
+                               f"this user and not accessible to others (mode 0700)")
+        if info.st_mode & 0o077:
+            # Readable by others but never writable (e.g. created by an older version): nobody
+            # else can have bound a socket in it, so tightening it is enough
+            os.chmod(self.directory, 0o700)
+
+    def send(self, frames):
+        if self._sender_pid != os.getpid():
+            self.check_directory()
+            self._sender_pid = os.getpid()
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.settimeout(SOCKET_SEND_TIMEOUT)
+        own_path = self.socket_path(self.origin)
+        for path in glob.glob(os.path.join(self.directory, '*.sock')):
+            if path == own_path:
+                continue
+            try:
+                for frame in frames:
+                    self._sender.sendto(frame.encode('ascii'), path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a process that has exited
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except (BlockingIOError, TimeoutError):
+                # That process is stuck; like a full listener queue, its clients resync later
+                logging.warning(f"Event bus receiver {path} is full, dropping event")
+
+    def receive_forever(self):
+        self.check_directory()
+        path = self.socket_path(self.origin)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            receiver.bind(path)
+            while True:
+                self.received(receiver.recv(self.max_frame_size).decode('ascii'))
+        finally:
+            receiver.close()
+            if os.path.exists(path):
+                os.remove(path)
+
+class PostgresEventBus(EventBus):
+    """NOTIFY on a channel of the application database; every receiving process LISTENs"""
+
+    max_frame_size = 7900  # NOTIFY payloads must stay under 8000 bytes
+
+    def __init__(self, deliver, channel):
+        super().__init__(deliver)
+        self.channel = channel
+
+    def send(self, frames):
+        with app.app_context():
+            with db.engine.connect() as connection:
+                # One transaction, so the frames of a split message arrive together and in order
+                for frame in frames:
+                    connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                       {'channel': self.channel, 'payload': frame})
+                connection.commit()
+
+    def receive_forever(self):
+        with app.app_context():
+            connection = db.engine.raw_connection()
+        try:
+            # A dedicated psycopg2 connection outside any transaction, so notifications arrive as sent
+            listener = connection.driver_connection
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                if select.select([listener], [], [], 30) == ([], [], []):
+                    # Idle: make sure the connection is still alive
+                    with listener.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    self.received(listener.notifies.pop(0).payload)
+        finally:
+            connection.invalidate()
+
+def create_event_bus(config, deliver):
+    backend = config['EVENT_BUS_BACKEND']
+    if backend == 'memory':
+        return InProcessEventBus(deliver)
+    if backend == 'socket':
+        return SocketEventBus(deliver, config['EVENT_BUS_SOCKET_DIR'])
+    if backend == 'postgres':
+        if db.engine.dialect.name != 'postgresql':
+            raise RuntimeError("EVENT_BUS_BACKEND=postgres needs a PostgreSQL DATABASE_URL")
+        return PostgresEventBus(deliver, config['EVENT_BUS_CHANNEL'])
+    raise RuntimeError(f"Unknown EVENT_BUS_BACKEND {backend!r}")
+
+with app.app_context():
+    broker.bus = create_event_bus(app.config, broker.deliver)
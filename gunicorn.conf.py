@@ -0,0 +1,86 @@
+import os
+import multiprocessing
+
+# Production server settings, picked up by a bare `gunicorn` run from this directory.
+# SERVER_MODE chooses the worker model without code changes:
+#   asgi    - uvicorn workers running asgi.py: event streams and long polls are held by the
+#             event loop (thousands per process), other routes run on a thread pool
+#   threads - gthread workers: one thread per in-flight request, and one for as long as each
+#             event stream or long poll is open (every chat tab holds one)
+#   gevent  - greenlet workers: Python I/O and psycopg2 (through psycogreen) yield to other
+#             greenlets; needs gevent and psycogreen installed. PostgreSQL only: sqlite3 calls
+#             can't be made cooperative and would stall every request and stream of the worker
+server_mode = os.environ.get('SERVER_MODE', 'asgi')
+
+if server_mode == 'gevent':
+    # Patch before the app (and with it SQLAlchemy, threading, sockets) is imported
+    from gevent import monkey
+    monkey.patch_all()
+    # psycopg2 is a C extension that monkey-patching doesn't reach; make its waits yield
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+cores = multiprocessing.cpu_count()
+
+def default_workers(count):
+    """Default worker count, capped so the workers' PostgreSQL pools fit DATABASE_MAX_CONNECTIONS"""
+    if not os.environ.get('DATABASE_URL', '').startswith(('postgres://', 'postgresql')):
+        return count
+    # Each worker may hold DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW connections (see app.py);
+    # the default budget leaves room under PostgreSQL's max_connections=100 for job workers,
+    # the event bus listener and admin sessions
+    connections_per_worker = int(os.environ.get('DATABASE_POOL_SIZE', 10)) + int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    budget = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 80))
+    return max(1, min(count, budget // connections_per_worker))
+
+if server_mode == 'threads':
+    # Threads mostly wait on the database and clients, so run more processes than cores
+    workers = int(os.environ.get('WEB_CONCURRENCY', default_workers(cores * 2 + 1)))
+    worker_class = 'gthread'
+    # Most threads sit in an idle event stream, so size for open tabs, not requests:
+    # workers x threads is the number of tabs (plus requests in flight) served at once
+    threads = int(os.environ.get('GUNICORN_THREADS', 128))
+    wsgi_app = 'main:app'
+elif server_mode == 'gevent':
+    workers = int(os.environ.get('WEB_CONCURRENCY', default_workers(cores)))
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+    wsgi_app = 'main:app'
+elif server_mode == 'asgi':
+    workers = int(os.environ.get('WEB_CONCURRENCY', default_workers(cores)))
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    wsgi_app = 'asgi:application'
+else:
+    raise RuntimeError(f"Unknown SERVER_MODE {server_mode!r}")
+
+if workers > 1:
+    # Realtime events must reach listeners held by the other workers (see eventbus.py)
+    os.environ.setdefault('EVENT_BUS_BACKEND', 'socket')
+
+# Worker liveness timeout. Threaded and async workers heartbeat independently of
+# requests, so long uploads and streams are not cut off by it.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Load the app once in the master: migrations run a single time (AUTO_MIGRATE) and
+# workers fork with the code already imported
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+def post_fork(server, worker):
+    # Connections opened by the master during preload must not be shared with the workers
+    from app import app, db
+    from realtime import broker
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if broker.bus is not None:
+        # Receive presence updates from the other workers from the start, not just once a
+        # client connects here, so every worker answers is_online() the same way
+        broker.bus.start()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import or_, and_
+from app import app, db
+from models import Job
+
+# Database-backed job queue: jobs are rows in the `jobs` table, claimed with a
+# conditional UPDATE so any number of threads and worker processes can share it.
+JOB_HANDLERS = {}
+
+def job(name):
+    """Register a function as the handler for jobs called `name`"""
+    def register(handler):
+        JOB_HANDLERS[name] = handler
+        return handler
+    return register
+
+def enqueue(name, **payload):
+    """Queue a job in the caller's transaction; workers see it once that commits"""
+    queued = Job(name=name, payload=json.dumps(payload), max_attempts=app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(queued)
+    return queued
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def claimable(now):
+    """Due queued jobs, plus running jobs whose worker has gone quiet for too long"""
+    stale = now - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT'])
+    return or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < stale)
+    )
+
+def claim_next(worker):
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(claimable(now)).order_by(Job.run_at).limit(10).all()
+    for (job_id,) in candidates:
+        # Only one worker's UPDATE can match; the others move on to the next candidate
+        claimed = Job.query.filter(Job.id == job_id, claimable(now)).update({
+            Job.status: 'running',
+            Job.locked_by: worker,
+            Job.locked_at: now,
+            Job.attempts: Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+def run_job(claimed):
+    """Run one claimed job: delete it on success, reschedule or fail it on error"""
+    job_id, name = claimed.id, claimed.name
+    try:
+        handler = JOB_HANDLERS.get(name)
+        if handler is None:
+            raise LookupError(f"No handler registered for job {name!r}")
+        handler(**json.loads(claimed.payload))
+    except Exception as e:
+        db.session.rollback()
+        failed = db.session.get(Job, job_id)
+        failed.last_error = f"{type(e).__name__}: {e}"
+        failed.locked_by = None
+        failed.locked_at = None
+        if failed.attempts >= failed.max_attempts:
+            failed.status = 'failed'
+            logging.error(f"Job {name} {job_id} failed permanently: {e}")
+        else:
+            # Exponential backoff between attempts
+            delay = app.config['JOB_RETRY_DELAY'] * 2 ** (failed.attempts - 1)
+            failed.status = 'queued'
+            failed.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            logging.warning(f"Job {name} {job_id} failed (attempt {failed.attempts}), retrying in {delay}s: {e}")
+        db.session.commit()
+        return False
+
+    Job.query.filter_by(id=job_id).delete(synchronize_session=False)
+    db.session.commit()
+    return True
+
+def run_pending(worker=None, limit=None):
+    """Run due jobs until none are left (or `limit` have run); returns how many ran"""
+    worker = worker or worker_name()
+    ran = 0
+    while limit is None or ran < limit:
+        claimed = claim_next(worker)
+        if claimed is None:
+            break
+        run_job(claimed)
+        ran += 1
+    return ran
+
+class JobRunner:
+    """Decides where queued jobs run, according to JOB_RUNNER"""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def notify(self):
+        """Call after committing new jobs"""
+        mode = app.config['JOB_RUNNER']
+        if mode == 'inline':
+            run_pending()
+        elif mode == 'thread':
+            self.ensure_started()
+            self._wake.set()
+        # 'worker': separate `flask run-jobs` processes poll the table
+
+    def ensure_started(self):
+        # Started lazily (and restarted after a fork) like the presence sweeper
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='job-runner', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(app.config['JOB_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    run_pending()
+            except Exception as e:
+                logging.error(f"Job runner failed: {e}")
+
+job_runner = JobRunner()
+
+@app.before_request
+def start_job_runner():
+    # Pick up jobs left over from before a restart without waiting for a new one
+    if app.config['JOB_RUNNER'] == 'thread':
+        job_runner.ensure_started()
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now and exit.')
+def run_jobs_command(once):
+    """Process background jobs; run one or more of these with JOB_RUNNER=worker."""
+    worker = worker_name()
+    if once:
+        click.echo(f"Ran {run_pending(worker)} jobs")
+        return
+
+    click.echo(f"Job worker {worker} started")
+    while True:
+        if not run_pending(worker):
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
@@ -0,0 +1,107 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import select
+from app import app, db
+from models import ConversationParticipant
+
+# Conversation membership cache for the per-request access checks. Entries are
+# the full member set of a conversation (groups have at most 10 members), so
+# one load answers "is X a participant" for every member plus the fan-out list
+# for realtime events. Routes that add participants must call invalidate()
+# after committing; otherwise entries expire after MEMBERSHIP_CACHE_TTL.
+
+class MemoryMembershipCache:
+    """Per-process LRU of conversation member sets with a TTL"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return None
+            expires_at, member_ids = entry
+            if expires_at <= time.monotonic():
+                del self._entries[conversation_id]
+                return None
+            self._entries.move_to_end(conversation_id)
+            return member_ids
+
+    def set(self, conversation_id, member_ids):
+        with self._lock:
+            self._entries[conversation_id] = (time.monotonic() + self.ttl, member_ids)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+class RedisMembershipCache:
+    """Member sets shared by every worker process through Redis, so invalidation reaches all of them"""
+
+    def __init__(self, url, ttl, key_prefix='membership:'):
+        import redis  # Optional dependency, only needed for MEMBERSHIP_CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def get(self, conversation_id):
+        cached = self.client.get(self.key_prefix + conversation_id)
+        return frozenset(json.loads(cached)) if cached is not None else None
+
+    def set(self, conversation_id, member_ids):
+        self.client.setex(self.key_prefix + conversation_id, self.ttl, json.dumps(sorted(member_ids)))
+
+    def invalidate(self, conversation_id):
+        self.client.delete(self.key_prefix + conversation_id)
+
+def create_membership_cache(config):
+    backend = config['MEMBERSHIP_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryMembershipCache(config['MEMBERSHIP_CACHE_SIZE'], config['MEMBERSHIP_CACHE_TTL'])
+    if backend == 'redis':
+        return RedisMembershipCache(config['REDIS_URL'], config['MEMBERSHIP_CACHE_TTL'])
+    raise RuntimeError(f"Unknown MEMBERSHIP_CACHE_BACKEND {backend!r}")
+
+membership_cache = create_membership_cache(app.config)
+
+def conversation_member_ids(conversation_id):
+    """User ids of a conversation's participants, from the cache when possible"""
+    try:
+        member_ids = membership_cache.get(conversation_id)
+    except Exception as e:
+        # A shared cache being down must not lock everyone out; fall back to the database
+        logging.warning(f"Membership cache lookup failed: {e}")
+        member_ids = None
+    if member_ids is not None:
+        return member_ids
+
+    # Always from the primary: a lagging replica would cache a new member's absence for everyone
+    member_ids = frozenset(db.session.execute(
+        select(ConversationParticipant.user_id).filter_by(conversation_id=conversation_id),
+        bind_arguments={'bind': db.engine}
+    ).scalars())
+    try:
+        membership_cache.set(conversation_id, member_ids)
+    except Exception as e:
+        logging.warning(f"Membership cache update failed: {e}")
+    return member_ids
+
+def is_participant(conversation_id, user_id):
+    return user_id in conversation_member_ids(conversation_id)
+
+def invalidate_membership(conversation_id):
+    """Call after committing a change to a conversation's participants"""
+    try:
+        membership_cache.invalidate(conversation_id)
+    except Exception as e:
+        logging.error(f"Membership cache invalidation failed for {conversation_id}: {e}")
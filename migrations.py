@@ -0,0 +1,124 @@
+import logging
+from datetime import datetime
+import click
+from sqlalchemy import inspect, text
+from app import app, db
+from models import ConversationParticipant, ConversationSummary, Message, UploadSession, SchemaMigration
+
+# Versioned schema migrations. create_all() only creates missing tables, so
+# every change to an existing table (new columns, indexes, data fixes) is a
+# numbered step here. Steps run once, in order, and are recorded in the
+# schema_migrations table; each one must also be safe on a freshly created
+# database, where its columns and tables already exist.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(step):
+        MIGRATIONS.append((version, description, step))
+        return step
+    return register
+
+def add_column(model, column_name):
+    """ALTER TABLE ADD COLUMN for a column declared on a model, if the table lacks it"""
+    table = model.__table__
+    existing_columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    if column_name in existing_columns:
+        return
+    column = table.columns[column_name]
+    column_ddl = f"{column.name} {column.type.compile(dialect=db.engine.dialect)}"
+    if column.server_default is not None:
+        column_ddl += f" DEFAULT {column.server_default.arg}"
+    db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+
+def create_index(model, index_name):
+    """Create an index declared on a model, if it doesn't exist yet"""
+    index = next(index for index in model.__table__.indexes if index.name == index_name)
+    index.create(bind=db.session.connection(), checkfirst=True)
+
+@migration(1, 'Read state and attachment metadata columns')
+def add_columns_since_initial_schema():
+    # Data migrations query through the current models, so every column they map comes first
+    add_column(ConversationParticipant, 'unread_count')
+    add_column(ConversationParticipant, 'last_read_message_id')
+    add_column(ConversationParticipant, 'last_read_at')
+    add_column(Message, 'image_width')
+    add_column(Message, 'image_height')
+    add_column(Message, 'processed_at')
+    add_column(ConversationSummary, 'version')
+
+@migration(2, 'Conversation summaries and unread counters')
+def build_conversation_summaries():
+    from summaries import rebuild_summaries
+    rebuild_summaries()
+
+@migration(3, 'Collapse per-message read receipts into watermarks')
+def collapse_message_seen():
+    from summaries import collapse_receipts
+    collapse_receipts()
+
+@migration(4, 'Message history and blob reference indexes')
+def add_message_indexes():
+    create_index(Message, 'ix_messages_conversation_timestamp_id')  # Replaced its (conversation_id, timestamp) index in 8
+    create_index(Message, 'ix_messages_file_path')
+
+@migration(5, 'Full-text message search')
+def add_message_search():
+    from search import ensure_search_index
+    ensure_search_index()
+
+@migration(6, 'Indexes for participant checks, inbox and upload queries')
+def add_hot_path_indexes():
+    # The participant check is a unique lookup; drop duplicate memberships first
+    db.session.execute(text(
+        "DELETE FROM conversation_participants WHERE id NOT IN ("
+        "SELECT MIN(id) FROM conversation_participants GROUP BY conversation_id, user_id)"
+    ))
+    create_index(ConversationParticipant, 'uq_conversation_participants_conversation_user')
+    create_index(ConversationParticipant, 'ix_conversation_participants_user_conversation')
+    create_index(Message, 'ix_messages_sender_id')
+    create_index(UploadSession, 'ix_upload_sessions_updated_at')
+
+@migration(7, 'Conversation versions for response caching')
+def add_conversation_versions():
+    # Also in migration 1, for databases that reach the summary rebuild only now
+    add_column(ConversationSummary, 'version')
+
+@migration(8, 'Message history index covering the (timestamp, id) page order')
+def extend_message_history_index():
+    create_index(Message, 'ix_messages_conversation_timestamp_id')
+    # A prefix of the new index, so only a cost on every insert
+    db.session.execute(text("DROP INDEX IF EXISTS ix_messages_conversation_timestamp"))
+
+def applied_versions():
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+def migrate():
+    """Create missing tables and run every pending migration; returns the versions applied"""
+    db.create_all(bind_key=None)  # The primary only; a replica gets the schema through replication
+    applied = applied_versions()
+    newly_applied = []
+    for version, description, step in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        if version in applied:
+            continue
+        logging.info(f"Applying migration {version}: {description}")
+        if db.engine.dialect.name == 'postgresql':
+            # Index builds and backfills may outlast DATABASE_STATEMENT_TIMEOUT
+            db.session.execute(text("SET LOCAL statement_timeout = 0"))
+        step()
+        db.session.add(SchemaMigration(version=version, description=description, applied_at=datetime.utcnow()))
+        db.session.commit()
+        newly_applied.append(version)
+    return newly_applied
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    newly_applied = migrate()
+    click.echo(f"Applied {len(newly_applied)} migrations" + (f": {newly_applied}" if newly_applied else ""))
+
+@app.cli.command('migrations')
+def migrations_command():
+    """List database migrations and whether they have been applied."""
+    applied = applied_versions()
+    for version, description, _ in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        click.echo(f"[{'x' if version in applied else ' '}] {version:03d} {description}")
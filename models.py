@@ -42,28 +42,63 @@ class Conversation(db.Model):
 
 class ConversationParticipant(db.Model):
     __tablename__ = 'conversation_participants'
+    __table_args__ = (
+        # The membership check on every request, and one row per member
+        db.Index('uq_conversation_participants_conversation_user', 'conversation_id', 'user_id', unique=True),
+        # "My conversations" lookups, answered from the index alone
+        db.Index('ix_conversation_participants_user_conversation', 'user_id', 'conversation_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('users.user_id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Read state, maintained by the message and mark-seen routes
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_read_message_id = db.Column(db.String(36))
+    last_read_at = db.Column(db.DateTime)
+    
     def __init__(self, **kwargs):
         super(ConversationParticipant, self).__init__(**kwargs)
 
+class ConversationSummary(db.Model):
+    __tablename__ = 'conversation_summaries'
+    
+    # Denormalized last-message details so the inbox doesn't scan messages
+    conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), primary_key=True)
+    last_message_id = db.Column(db.String(36))
+    last_message_preview = db.Column(db.Text)
+    last_message_sender_id = db.Column(db.String(36))
+    last_message_sender_name = db.Column(db.String(100))
+    last_message_at = db.Column(db.DateTime, index=True)
+    # Bumped by every write that changes what the conversation's pages show
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    def __init__(self, **kwargs):
+        super(ConversationSummary, self).__init__(**kwargs)
+
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # History paging and `since` deltas scan a conversation in (timestamp, id) order, the
+        # page cursor, so pages are read straight from the index without a sort
+        db.Index('ix_messages_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
-    sender_id = db.Column(db.String(36), db.ForeignKey('users.user_id'), nullable=False)
+    sender_id = db.Column(db.String(36), db.ForeignKey('users.user_id'), nullable=False, index=True)
     content = db.Column(db.Text)
     message_type = db.Column(db.String(20), default='text')  # 'text', 'file', 'audio', 'image'
-    file_path = db.Column(db.String(500))
+    file_path = db.Column(db.String(500), index=True)
     file_name = db.Column(db.String(255))
     file_size = db.Column(db.Integer)
     file_type = db.Column(db.String(100))
     audio_duration = db.Column(db.Float)  # Duration in seconds for audio files
+    image_width = db.Column(db.Integer)
+    image_height = db.Column(db.Integer)
+    processed_at = db.Column(db.DateTime)  # Set when background attachment processing finishes
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -73,13 +108,55 @@ class Message(db.Model):
     def __init__(self, **kwargs):
         super(Message, self).__init__(**kwargs)
 
-class MessageSeen(db.Model):
-    __tablename__ = 'message_seen'
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
     
-    id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.String(36), db.ForeignKey('messages.id'), nullable=False)
+    # In-progress chunked upload; becomes a Message on finalize
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.user_id'), nullable=False)
-    seen_at = db.Column(db.DateTime, default=datetime.utcnow)
+    conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
+    file_name = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(100))
+    message_type = db.Column(db.String(20), default='file')
+    file_size = db.Column(db.BigInteger, nullable=False)
+    received_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    audio_duration = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    def __init__(self, **kwargs):
+        super(UploadSession, self).__init__(**kwargs)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Workers look for the oldest due job
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    
+    # Background job; deleted once it succeeds (see jobs.py)
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON keyword arguments for the handler
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(200))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __init__(self, **kwargs):
+        super(Job, self).__init__(**kwargs)
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    # One row per applied migration (see migrations.py)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __init__(self, **kwargs):
-        super(MessageSeen, self).__init__(**kwargs)
+        super(SchemaMigration, self).__init__(**kwargs)
@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import update, bindparam
+from app import app, db
+from models import User, ConversationParticipant
+from realtime import broker
+
+# A user goes offline when no heartbeat arrives for this long (main.js beats every 30s)
+PRESENCE_TTL = int(os.environ.get("PRESENCE_TTL", 75))
+# How often expired users are swept and last_seen is written back to the database
+PRESENCE_SWEEP_INTERVAL = int(os.environ.get("PRESENCE_SWEEP_INTERVAL", 5))
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get("PRESENCE_FLUSH_INTERVAL", 60))
+
+class PresenceTracker:
+    """In-memory presence with heartbeat expiry and batched last_seen persistence.
+
+    Every worker process keeps the full picture: heartbeats and sign-outs are
+    broadcast over the event bus (see eventbus.py) and applied by the other
+    processes' trackers too, so they all agree on who is online and expire
+    users at the same moment. Each process then announces the transitions it
+    sees to its own listeners only (publish_presence), and persists last_seen
+    only for the users whose latest activity it received itself.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL, sweep_interval=PRESENCE_SWEEP_INTERVAL,
+                 flush_interval=PRESENCE_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.flush_interval = flush_interval
+        self._expires_at = {}
+        self._last_seen = {}
+        self._dirty = set()
+        self._heard_here = set()
+        self._stream_heartbeats = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._last_flush = time.monotonic()
+
+    def heartbeat(self, user_id):
+        """Record activity from a user; returns True if they just came online"""
+        last_seen = datetime.utcnow()
+        came_online = self.record_heartbeat(user_id, last_seen, heard_here=True)
+        broker.broadcast('presence_heartbeat', {'user_id': user_id, 'last_seen': last_seen.isoformat()})
+        return came_online
+
+    def set_offline(self, user_id):
+        """Mark a user offline now; returns True if they were online"""
+        last_seen = datetime.utcnow()
+        was_online = self.record_offline(user_id, last_seen, heard_here=True)
+        broker.broadcast('presence_offline', {'user_id': user_id, 'last_seen': last_seen.isoformat()})
+        return was_online
+
+    def stream_heartbeat_due(self, user_id, interval):
+        """True for the first of a user's open event streams in this process to beat in each interval"""
+        # One heartbeat per user per interval, not one per open tab, each of which goes over the bus
+        now = time.monotonic()
+        with self._lock:
+            last = self._stream_heartbeats.get(user_id)
+            if last is not None and now - last < interval and user_id in self._expires_at:
+                return False
+            self._stream_heartbeats[user_id] = now
+        return True
+
+    def record_heartbeat(self, user_id, last_seen, heard_here):
+        self._ensure_worker()
+        with self._lock:
+            came_online = user_id not in self._expires_at
+            self._expires_at[user_id] = time.monotonic() + self.ttl
+            self._last_seen[user_id] = last_seen
+            self._record_source(user_id, heard_here)
+        return came_online
+
+    def record_offline(self, user_id, last_seen, heard_here):
+        with self._lock:
+            was_online = self._expires_at.pop(user_id, None) is not None
+            self._stream_heartbeats.pop(user_id, None)
+            self._last_seen[user_id] = last_seen
+            self._record_source(user_id, heard_here)
+        return was_online
+
+    def _record_source(self, user_id, heard_here):
+        # Only the process that received the user's latest activity writes it to the database
+        if heard_here:
+            self._heard_here.add(user_id)
+            self._dirty.add(user_id)
+        else:
+            self._heard_here.discard(user_id)
+
+    def is_online(self, user_id):
+        with self._lock:
+            expires_at = self._expires_at.get(user_id)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def last_seen(self, user_id):
+        with self._lock:
+            return self._last_seen.get(user_id)
+
+    def expire(self):
+        """Drop users whose heartbeat lapsed and return their ids"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id, expires_at in self._expires_at.items() if expires_at <= now]
+            for user_id in expired:
+                del self._expires_at[user_id]
+                self._stream_heartbeats.pop(user_id, None)
+                if user_id in self._heard_here:
+                    self._dirty.add(user_id)
+        return expired
+
+    def flush(self):
+        """Write pending last_seen/online values to the users table in one batch"""
+        with self._lock:
+            pending = [{
+                'target_user_id': user_id,
+                'last_seen': self._last_seen[user_id],
+                'online': user_id in self._expires_at
+            } for user_id in self._dirty]
+            self._dirty.clear()
+
+        if pending:
+            # Core executemany: sessions of since-deleted users just match no row
+            users = User.__table__
+            db.session.execute(
+                update(users).where(users.c.user_id == bindparam('target_user_id')),
+                pending
+            )
+            db.session.commit()
+        return len(pending)
+
+    def sweep(self):
+        """Expire lapsed users, announce them offline and persist periodically"""
+        with app.app_context():
+            for user_id in self.expire():
+                publish_presence(user_id, False, self.last_seen(user_id))
+
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._last_flush = time.monotonic()
+                self.flush()
+
+    def _ensure_worker(self):
+        # Started lazily (and restarted after a fork) so each worker process sweeps its own state
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='presence-sweeper', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Presence sweep failed: {e}")
+
+def publish_presence(user_id, online, last_seen):
+    """Tell everyone connected to this process who shares a conversation with the user about their status.
+
+    Every process sees the same transitions (see PresenceTracker), so each one
+    delivers to its own listeners and nothing crosses the event bus.
+    """
+    shared_conversations = db.session.query(ConversationParticipant.conversation_id).filter_by(
+        user_id=user_id
+    )
+    contact_ids = [contact_id for (contact_id,) in db.session.query(ConversationParticipant.user_id).filter(
+        ConversationParticipant.conversation_id.in_(shared_conversations),
+        ConversationParticipant.user_id != user_id
+    ).distinct()]
+    broker.deliver(contact_ids, 'presence', {
+        'user_id': user_id,
+        'online': online,
+        'last_seen': last_seen.isoformat() if last_seen else None
+    })
+
+def stream_heartbeat(user_id):
+    """Heartbeat from an open event stream; announces the user if it brought them back online.
+
+    Blocks on event bus and database I/O, so ASGI streams run it on an executor.
+    """
+    try:
+        # e.g. a stream that survived a laptop sleep longer than the TTL
+        if presence.heartbeat(user_id):
+            with app.app_context():
+                publish_presence(user_id, True, presence.last_seen(user_id))
+    except Exception as e:
+        logging.error(f"Event stream heartbeat for {user_id} failed: {e}")
+
+def remote_heartbeat(data):
+    """A heartbeat received by another process"""
+    last_seen = datetime.fromisoformat(data['last_seen'])
+    if presence.record_heartbeat(data['user_id'], last_seen, heard_here=False):
+        with app.app_context():
+            publish_presence(data['user_id'], True, last_seen)
+
+def remote_offline(data):
+    """A sign-out received by another process"""
+    last_seen = datetime.fromisoformat(data['last_seen'])
+    if presence.record_offline(data['user_id'], last_seen, heard_here=False):
+        with app.app_context():
+            publish_presence(data['user_id'], False, last_seen)
+
+presence = PresenceTracker()
+broker.on('presence_heartbeat', remote_heartbeat)
+broker.on('presence_offline', remote_offline)
@@ -0,0 +1,117 @@
+import json
+import queue
+import asyncio
+import threading
+
+
+class Listener(queue.Queue):
+    """Event queue for a stream served on a thread"""
+
+    # Set once an event had to be dropped; the stream should end so the client resyncs
+    overflowed = False
+
+
+class EventBroker:
+    """Pub/sub that fans events out to connected users.
+
+    Listeners live in this process; an attached event bus (see eventbus.py)
+    carries published events to the brokers of the other worker processes.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self.bus = None
+        self._handlers = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, listener=None):
+        """Register a new listener for a user and return its event queue"""
+        if listener is None:
+            listener = Listener(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(listener)
+        if self.bus is not None:
+            # Only processes with listeners need to receive from the bus
+            self.bus.start()
+        return listener
+
+    def unsubscribe(self, user_id, listener):
+        with self._lock:
+            listeners = self._subscribers.get(user_id)
+            if listeners:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._subscribers[user_id]
+
+    def is_connected(self, user_id):
+        with self._lock:
+            return user_id in self._subscribers
+
+    def publish(self, user_ids, event, data):
+        """Deliver an event to every listener of the given users, in every process"""
+        user_ids = list(set(user_ids))
+        self.deliver(user_ids, event, data)
+        if self.bus is not None:
+            self.bus.publish(user_ids, event, data)
+
+    def broadcast(self, event, data):
+        """Send an event to the handler registered with on() in every other process"""
+        if self.bus is not None:
+            self.bus.publish([], event, data)
+
+    def on(self, event, handler):
+        """Handle broadcast() events from other processes with handler(data)"""
+        self._handlers[event] = handler
+
+    def deliver(self, user_ids, event, data):
+        """Deliver an event to the given users' listeners in this process"""
+        handler = self._handlers.get(event)
+        if handler is not None:
+            handler(data)
+            return
+        with self._lock:
+            listeners = [listener
+                         for user_id in set(user_ids)
+                         for listener in self._subscribers.get(user_id, ())]
+
+        for listener in listeners:
+            try:
+                listener.put_nowait((event, data))
+            except queue.Full:
+                # Slow consumer: its stream ends, and the client resyncs from the REST API on reconnect
+                listener.overflowed = True
+
+
+class AsyncListener:
+    """Event queue consumed on an asyncio loop; publishers may call put_nowait from any thread"""
+
+    overflowed = False
+
+    def __init__(self, loop, max_queue_size=100):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+
+    def put_nowait(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            pass  # Loop already closed; the stream is gone
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Slow consumer, as with queue.Full above
+            self.overflowed = True
+
+    async def get(self):
+        return await self._queue.get()
+
+
+def format_sse(event, data):
+    """Serialize an event in text/event-stream format"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+broker = EventBroker()
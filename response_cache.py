@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from app import app
+
+# Cache of serialized API responses (message pages, inbox skeletons). Keys embed
+# the conversation versions the payload was built from (see bump_version() in
+# summaries.py), so a write never has to find and delete entries: it bumps the
+# version and later requests look up a new key, leaving old ones to age out.
+
+class MemoryResponseCache:
+    """Per-process LRU of response bodies, bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = body
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+class RedisResponseCache:
+    """Bodies shared by every worker on a Redis-protocol server (Redis, Valkey, KeyDB, ...)"""
+
+    def __init__(self, url, ttl, key_prefix='response:'):
+        import redis  # Optional dependency, only needed for RESPONSE_CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.client.get(self.key_prefix + key)
+
+    def set(self, key, body):
+        # Superseded versions are never read again; the TTL lets the server reclaim them
+        self.client.setex(self.key_prefix + key, self.ttl, body)
+
+def create_response_cache(config):
+    backend = config['RESPONSE_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryResponseCache(config['RESPONSE_CACHE_MAX_ENTRIES'], config['RESPONSE_CACHE_MAX_BYTES'])
+    if backend == 'redis':
+        return RedisResponseCache(config['REDIS_URL'], config['RESPONSE_CACHE_TTL'])
+    raise RuntimeError(f"Unknown RESPONSE_CACHE_BACKEND {backend!r}")
+
+response_cache = create_response_cache(app.config)
+
+def cache_get(key):
+    try:
+        return response_cache.get(key)
+    except Exception as e:
+        # An unreachable shared cache only costs the rebuild
+        logging.warning(f"Response cache lookup failed: {e}")
+        return None
+
+def cache_set(key, body):
+    try:
+        response_cache.set(key, body)
+    except Exception as e:
+        logging.warning(f"Response cache update failed: {e}")
+
+def response_etag(*parts):
+    """Opaque ETag value for a cache key or response body"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -1,12 +1,54 @@
 import os
+import json
+import time
+import queue
+import hashlib
 import mimetypes
-from datetime import datetime
-from flask import render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory
-from werkzeug.utils import secure_filename
-from sqlalchemy import or_, and_, desc
-from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote as url_quote
+from flask import render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory, Response
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
+from sqlalchemy import or_, and_, desc, func, case, select
+from sqlalchemy.orm import joinedload, aliased
 from app import app, db
-from models import User, Conversation, ConversationParticipant, Message, MessageSeen
+from models import User, Conversation, ConversationParticipant, ConversationSummary, Message, UploadSession
+from realtime import broker, format_sse
+from summaries import record_message, record_read
+from presence import presence, publish_presence, stream_heartbeat
+from blobs import store_stream, store_file
+from storage import storage
+from thumbnails import THUMBNAIL_SIZES, thumbnails_supported, thumbnail_key, generate_thumbnails
+from jobs import enqueue, job_runner
+from search import index_message, search_message_ids
+from membership import is_participant, conversation_member_ids, invalidate_membership
+from response_cache import cache_get, cache_set, response_etag
+from database import replica_reads
+import attachments  # noqa: F401  (registers the attachment job handlers)
+import eventbus  # noqa: F401  (connects the broker to the other worker processes)
+
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_KEEPALIVE = 15
+
+# Seconds a /api/wait long poll may block without changes (kept under proxy and worker timeouts)
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 55
+
+# Broker events that come with a conversation version bump and wake long polls
+CHANGE_EVENTS = {'new_message', 'seen', 'message_updated', 'conversation_created'}
+
+# Message history paging
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+# Search result paging
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+
+# Chunk bodies are copied to disk in blocks of this size
+UPLOAD_STREAM_BLOCK_SIZE = 64 * 1024
+
+# Attachments never change once uploaded, so browsers may keep them for a year
+ATTACHMENT_MAX_AGE = 365 * 24 * 60 * 60
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -46,6 +88,94 @@ def format_file_size(size_bytes):
         i += 1
     return f"{size_bytes:.1f}{size_names[i]}"
 
+def serialize_message(msg, sender_name, seen_by):
+    """Build the JSON payload the chat client renders for a message"""
+    message_data = {
+        'id': msg.id,
+        'conversation_id': msg.conversation_id,
+        'sender_id': msg.sender_id,
+        'sender_name': sender_name,
+        'content': msg.content,
+        'message_type': msg.message_type,
+        'timestamp': msg.timestamp.isoformat(),
+        'seen_by': seen_by
+    }
+    
+    # Add file information if it's a file message
+    if msg.message_type in ['file', 'audio', 'image']:
+        message_data.update({
+            'file_name': msg.file_name,
+            'file_size': msg.file_size,
+            'file_type': msg.file_type,
+            'file_size_formatted': format_file_size(msg.file_size) if msg.file_size else '0B',
+            'file_icon': get_file_icon(msg.file_type or ''),
+            'audio_duration': msg.audio_duration
+        })
+        if msg.message_type == 'image':
+            message_data.update({
+                'image_width': msg.image_width,
+                'image_height': msg.image_height
+            })
+    
+    return message_data
+
+def tick_status(seen_count, total_recipients):
+    """Determine status: sent (1 tick), delivered (2 gray ticks), seen (2 blue ticks)"""
+    if seen_count == 0:
+        return 'delivered'  # 2 gray ticks
+    elif seen_count == total_recipients:
+        return 'seen'  # 2 blue ticks
+    else:
+        return 'partially_seen'  # 2 blue ticks
+
+def seen_by_from_watermarks(msg, watermarks):
+    """Users whose read watermark has reached a message, excluding its sender"""
+    return [user_id for user_id, last_read_at in watermarks
+            if user_id != msg.sender_id and last_read_at is not None and last_read_at >= msg.timestamp]
+
+def resolve_message_cursor(conversation_id, cursor):
+    """Turn a message id or ISO timestamp cursor into a (timestamp, message_id) position"""
+    message = db.session.query(Message.timestamp, Message.id).filter_by(
+        id=cursor,
+        conversation_id=conversation_id
+    ).first()
+    if message:
+        return message.timestamp, message.id
+    
+    # Not a message in this conversation; treat it as a timestamp (raises ValueError otherwise)
+    timestamp = datetime.fromisoformat(cursor.replace('Z', '+00:00'))
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp, None
+
+def message_type_for(file_type):
+    """Determine message type based on file type"""
+    if file_type.startswith('image/'):
+        return 'image'
+    elif file_type.startswith('audio/'):
+        return 'audio'
+    return 'file'
+
+def save_file_message(message):
+    """Commit an attachment message with its summary update and push it to the conversation"""
+    sender = User.query.get(message.sender_id)
+    sender_name = sender.name if sender else 'Unknown'
+    
+    db.session.add(message)
+    db.session.flush()
+    record_message(message, sender_name)
+    index_message(message)
+    # Thumbnails, probing etc. run in the background; the job commits with the message
+    enqueue('process_attachment', message_id=message.id)
+    db.session.commit()
+    
+    publish_to_conversation(message.conversation_id, 'new_message', serialize_message(message, sender_name, []))
+    job_runner.notify()
+
+def publish_to_conversation(conversation_id, event, data):
+    """Push an event to every participant of a conversation"""
+    broker.publish(conversation_member_ids(conversation_id), event, data)
+
 @app.route('/')
 def landing():
     if 'user_id' in session:
@@ -69,9 +199,8 @@ def chat():
         return redirect(url_for('landing'))
     
     # Update user online status
-    user.online = True
-    user.last_seen = datetime.utcnow()
-    db.session.commit()
+    if presence.heartbeat(user.user_id):
+        publish_presence(user.user_id, True, presence.last_seen(user.user_id))
     
     return render_template('chat.html', user=user)
 
@@ -90,11 +219,9 @@ def settings():
 @app.route('/logout')
 def logout():
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-        if user:
-            user.online = False
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
+        user_id = session['user_id']
+        if presence.set_offline(user_id):
+            publish_presence(user_id, False, presence.last_seen(user_id))
     
     session.clear()
     return redirect(url_for('landing'))
@@ -128,7 +255,116 @@ def api_register():
         app.logger.error(f"Registration error: {e}")
         return jsonify({'success': False, 'message': 'Registration failed'})
 
+def inbox_entries(user_id):
+    """The user's conversation list without presence, which changes too often to cache"""
+    my_conversations = db.session.query(ConversationParticipant.conversation_id).filter(
+        ConversationParticipant.user_id == user_id
+    )
+    
+    # Conversations with their maintained summary, newest activity first
+    rows = db.session.query(
+        Conversation,
+        ConversationParticipant.unread_count,
+        ConversationSummary
+    ).join(
+        ConversationParticipant,
+        Conversation.id == ConversationParticipant.conversation_id
+    ).outerjoin(
+        ConversationSummary,
+        ConversationSummary.conversation_id == Conversation.id
+    ).filter(
+        ConversationParticipant.user_id == user_id
+    ).order_by(
+        ConversationSummary.last_message_at.desc().nulls_last(),
+        Conversation.created_at.desc()
+    ).all()
+    
+    # Load everyone's participants in one query
+    participants_by_conversation = {}
+    for conversation_id, participant in db.session.query(
+        ConversationParticipant.conversation_id, User
+    ).join(
+        User,
+        User.user_id == ConversationParticipant.user_id
+    ).filter(
+        ConversationParticipant.conversation_id.in_(my_conversations)
+    ):
+        participants_by_conversation.setdefault(conversation_id, []).append(participant)
+    
+    result = []
+    for conv, unread_count, summary in rows:
+        participants = participants_by_conversation.get(conv.id, [])
+        
+        last_message = None
+        if summary and summary.last_message_at:
+            last_message = {
+                'content': summary.last_message_preview,
+                'timestamp': summary.last_message_at.isoformat(),
+                'sender_name': summary.last_message_sender_name or 'Unknown'
+            }
+        
+        # For private chats, use the other participant's info
+        if conv.type == 'private':
+            other_participant = next((p for p in participants if p.user_id != user_id), None)
+            conv_name = other_participant.name if other_participant else "Unknown User"
+        else:
+            conv_name = conv.name
+        
+        result.append({
+            'id': conv.id,
+            'name': conv_name,
+            'type': conv.type,
+            'participants': [{'id': p.user_id, 'name': p.name} for p in participants],
+            'last_message': last_message,
+            'unread_count': unread_count,
+            'version': summary.version if summary else 0
+        })
+    return result
+
+def apply_presence(entries, user_id):
+    """Fill in current online flags on inbox entries"""
+    for entry in entries:
+        for participant in entry['participants']:
+            participant['online'] = presence.is_online(participant['id'])
+        # The other person in a private chat, anyone else in a group
+        entry['online'] = any(p['online'] for p in entry['participants'] if p['id'] != user_id)
+    return entries
+
+def conversation_versions(user_id):
+    """(conversation id, version) for each of the user's conversations, in id order"""
+    return [(conversation_id, version or 0) for conversation_id, version in db.session.execute(
+        select(ConversationParticipant.conversation_id, ConversationSummary.version).outerjoin(
+            ConversationSummary,
+            ConversationSummary.conversation_id == ConversationParticipant.conversation_id
+        ).where(
+            ConversationParticipant.user_id == user_id
+        ).order_by(ConversationParticipant.conversation_id)
+    )]
+
+def changed_versions(user_id, known_versions):
+    """The user's conversations whose version differs from the client's, including new ones"""
+    return {conversation_id: version for conversation_id, version in conversation_versions(user_id)
+            if known_versions.get(conversation_id) != version}
+
+def inbox_cache_key(user_id):
+    """Changes whenever one of the user's conversations is written to or a new one appears"""
+    versions = conversation_versions(user_id)
+    return f"inbox:{user_id}:{response_etag(*(f'{conversation_id}:{version}' for conversation_id, version in versions))}"
+
+def conversation_version(conversation_id):
+    return db.session.execute(
+        select(ConversationSummary.version).where(ConversationSummary.conversation_id == conversation_id)
+    ).scalar() or 0
+
+def revalidated(response, etag):
+    """Attach an ETag and make browsers check back before reusing the response"""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/conversations')
+@replica_reads
 def api_conversations():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -136,69 +372,73 @@ def api_conversations():
     user_id = session['user_id']
     
     try:
-        # Get conversations where user is a participant
-        conversations = db.session.query(Conversation).join(
-            ConversationParticipant,
-            Conversation.id == ConversationParticipant.conversation_id
-        ).filter(
-            ConversationParticipant.user_id == user_id
-        ).all()
-        
-        result = []
-        for conv in conversations:
-            # Get other participants
-            participants = db.session.query(User).join(
-                ConversationParticipant,
-                User.user_id == ConversationParticipant.user_id
-            ).filter(
-                ConversationParticipant.conversation_id == conv.id
-            ).all()
-            
-            # Get last message
-            last_message = None
-            last_msg = Message.query.filter_by(conversation_id=conv.id).order_by(Message.timestamp.desc()).first()
-            if last_msg:
-                sender = User.query.get(last_msg.sender_id)
-                last_message = {
-                    'content': last_msg.content or (f"📎 {last_msg.file_name}" if last_msg.message_type == 'file' else 
-                                                  "🎵 Voice message" if last_msg.message_type == 'audio' else 
-                                                  "📷 Image" if last_msg.message_type == 'image' else last_msg.content),
-                    'timestamp': last_msg.timestamp.isoformat(),
-                    'sender_name': sender.name if sender else 'Unknown'
-                }
-            
-            # For private chats, use the other participant's info
-            if conv.type == 'private':
-                other_participant = next((p for p in participants if p.user_id != user_id), None)
-                if other_participant:
-                    conv_name = other_participant.name
-                    online = other_participant.online
-                else:
-                    conv_name = "Unknown User"
-                    online = False
-            else:
-                conv_name = conv.name
-                online = any(p.online for p in participants if p.user_id != user_id)
-            
-            result.append({
-                'id': conv.id,
-                'name': conv_name,
-                'type': conv.type,
-                'online': online,
-                'participants': [{'id': p.user_id, 'name': p.name, 'online': p.online} for p in participants],
-                'last_message': last_message
-            })
-        
-        # Sort by last message timestamp
-        result.sort(key=lambda x: x['last_message']['timestamp'] if x['last_message'] else '1970-01-01T00:00:00', reverse=True)
-        
-        return jsonify({'success': True, 'conversations': result})
+        cache_key = inbox_cache_key(user_id)
+        body = cache_get(cache_key)
+        if body is None:
+            body = json.dumps(inbox_entries(user_id)).encode()
+            cache_set(cache_key, body)
+        
+        response = jsonify({'success': True, 'conversations': apply_presence(json.loads(body), user_id)})
+        return revalidated(response, response_etag(response.get_data())).make_conditional(request)
     
     except Exception as e:
         app.logger.error(f"Error loading conversations: {e}")
         return jsonify({'success': False, 'message': 'Failed to load conversations'})
 
+def message_page(conversation_id, since, before, limit):
+    """A page of serialized messages; raises ValueError for an unknown cursor"""
+    # Get messages, newer than `since` and/or older than `before`, with their senders
+    query = Message.query.options(joinedload(Message.sender)).filter_by(conversation_id=conversation_id)
+    if since:
+        timestamp, message_id = resolve_message_cursor(conversation_id, since)
+        if message_id:
+            query = query.filter(or_(
+                Message.timestamp > timestamp,
+                and_(Message.timestamp == timestamp, Message.id > message_id)
+            ))
+        else:
+            query = query.filter(Message.timestamp > timestamp)
+    if before:
+        timestamp, message_id = resolve_message_cursor(conversation_id, before)
+        if message_id:
+            query = query.filter(or_(
+                Message.timestamp < timestamp,
+                and_(Message.timestamp == timestamp, Message.id < message_id)
+            ))
+        else:
+            query = query.filter(Message.timestamp < timestamp)
+    
+    has_more = False
+    if limit and not since:
+        # Page backwards from the newest end, fetching one extra row to detect more history
+        messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = list(reversed(messages[:limit]))
+    elif limit:
+        messages = query.order_by(Message.timestamp, Message.id).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        messages = query.order_by(Message.timestamp, Message.id).all()
+    
+    # Seen status is derived from each participant's read watermark
+    watermarks = db.session.query(
+        ConversationParticipant.user_id,
+        ConversationParticipant.last_read_at
+    ).filter_by(conversation_id=conversation_id).all()
+    
+    result = []
+    for msg in messages:
+        result.append(serialize_message(
+            msg,
+            msg.sender.name if msg.sender else 'Unknown',
+            seen_by_from_watermarks(msg, watermarks)
+        ))
+    
+    return {'success': True, 'messages': result, 'has_more': has_more}
+
 @app.route('/api/messages/<conversation_id>')
+@replica_reads
 def api_messages(conversation_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -207,50 +447,83 @@ def api_messages(conversation_id):
     
     try:
         # Verify user is participant in this conversation
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'})
         
-        # Get messages
-        messages = Message.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(Message.timestamp).all()
-        
-        result = []
-        for msg in messages:
-            message_data = {
-                'id': msg.id,
-                'sender_id': msg.sender_id,
-                'sender_name': (lambda user: user.name if user else 'Unknown')(User.query.get(msg.sender_id)),
-                'content': msg.content,
-                'message_type': msg.message_type,
-                'timestamp': msg.timestamp.isoformat(),
-                'seen_by': [seen.user_id for seen in MessageSeen.query.filter_by(message_id=msg.id).all()]
-            }
-            
-            # Add file information if it's a file message
-            if msg.message_type in ['file', 'audio', 'image']:
-                message_data.update({
-                    'file_name': msg.file_name,
-                    'file_size': msg.file_size,
-                    'file_type': msg.file_type,
-                    'file_size_formatted': format_file_size(msg.file_size) if msg.file_size else '0B',
-                    'file_icon': get_file_icon(msg.file_type or ''),
-                    'audio_duration': msg.audio_duration
-                })
-            
-            result.append(message_data)
-        
-        return jsonify({'success': True, 'messages': result})
+        since = request.args.get('since')
+        before = request.args.get('before')
+        limit = request.args.get('limit', type=int)
+        if before and not limit:
+            limit = MESSAGE_PAGE_SIZE
+        if limit:
+            limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+        
+        # Pages are the same for every member, so they are cached per conversation version;
+        # an unchanged poll costs one version lookup and gets a 304
+        cache_key = f"messages:{conversation_id}:{conversation_version(conversation_id)}:{since}:{before}:{limit}"
+        etag = response_etag(cache_key)
+        if request.if_none_match.contains_weak(etag):
+            return revalidated(app.response_class(status=304), etag)
+        
+        body = cache_get(cache_key)
+        if body is None:
+            try:
+                body = jsonify(message_page(conversation_id, since, before, limit)).get_data()
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid cursor'})
+            cache_set(cache_key, body)
+        
+        return revalidated(app.response_class(body, mimetype='application/json'), etag)
     
     except Exception as e:
         app.logger.error(f"Error loading messages: {e}")
         return jsonify({'success': False, 'message': 'Failed to load messages'})
 
+@app.route('/api/search')
+@replica_reads
+def api_search():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    user_id = session['user_id']
+    
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'message': 'Search query is required'})
+        
+        conversation_id = request.args.get('conversation_id')
+        limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        
+        # Ranked ids from the full-text index, one extra to detect another page
+        message_ids = search_message_ids(user_id, query, conversation_id, limit + 1, offset)
+        has_more = len(message_ids) > limit
+        message_ids = message_ids[:limit]
+        
+        messages = {
+            msg.id: msg
+            for msg in Message.query.options(joinedload(Message.sender)).filter(Message.id.in_(message_ids))
+        }
+        
+        # Keep the index's ranking order
+        results = []
+        for message_id in message_ids:
+            msg = messages.get(message_id)
+            if msg:
+                results.append(serialize_message(msg, msg.sender.name if msg.sender else 'Unknown', []))
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None
+        })
+    
+    except Exception as e:
+        app.logger.error(f"Error searching messages: {e}")
+        return jsonify({'success': False, 'message': 'Search failed'})
+
 @app.route('/api/send_message', methods=['POST'])
 def api_send_message():
     if 'user_id' not in session:
@@ -267,12 +540,7 @@ def api_send_message():
             return jsonify({'success': False, 'message': 'Conversation ID and content are required'})
         
         # Verify user is participant
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'})
         
         # Create message
@@ -283,22 +551,18 @@ def api_send_message():
             message_type='text'
         )
         
-        db.session.add(message)
-        db.session.commit()
-        
         # Get sender info
         sender = User.query.get(user_id)
         
+        db.session.add(message)
+        db.session.flush()
+        record_message(message, sender.name if sender else 'Unknown')
+        index_message(message)
+        db.session.commit()
+        
         # Return complete message data for instant display
-        message_data = {
-            'id': message.id,
-            'sender_id': message.sender_id,
-            'sender_name': sender.name if sender else 'Unknown',
-            'content': message.content,
-            'message_type': message.message_type,
-            'timestamp': message.timestamp.isoformat(),
-            'seen_by': []  # Initially empty
-        }
+        message_data = serialize_message(message, sender.name if sender else 'Unknown', [])
+        publish_to_conversation(conversation_id, 'new_message', message_data)
         
         return jsonify({'success': True, 'message': message_data})
     
@@ -328,49 +592,31 @@ def api_upload_file():
             return jsonify({'success': False, 'message': 'No file selected'})
         
         # Verify user is participant
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'})
         
         if file and file.filename and allowed_file(file.filename):
             filename = secure_filename(file.filename) or 'unnamed_file'
             
-            # Create unique filename to avoid conflicts
-            base_name, ext = os.path.splitext(filename)
-            unique_filename = f"{base_name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}{ext}"
-            
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
+            # Stored by content hash, so identical files share one blob
+            stored_path, file_size = store_stream(file.stream)
             
             # Get file info
-            file_size = os.path.getsize(file_path)
             file_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
             
-            # Determine message type based on file type
-            message_type = 'file'
-            if file_type.startswith('image/'):
-                message_type = 'image'
-            elif file_type.startswith('audio/'):
-                message_type = 'audio'
-            
             # Create message
             message = Message(
                 conversation_id=conversation_id,
                 sender_id=user_id,
                 content=f"📎 {filename}",
-                message_type=message_type,
-                file_path=unique_filename,
+                message_type=message_type_for(file_type),
+                file_path=stored_path,
                 file_name=filename,
                 file_size=file_size,
                 file_type=file_type
             )
             
-            db.session.add(message)
-            db.session.commit()
+            save_file_message(message)
             
             return jsonify({'success': True, 'message': 'File uploaded successfully'})
         else:
@@ -399,21 +645,10 @@ def api_upload_audio():
             return jsonify({'success': False, 'message': 'Conversation ID is required'})
         
         # Verify user is participant
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'})
         
-        # Create unique filename
-        filename = f"voice_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.webm"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        audio_file.save(file_path)
-        
-        # Get file info
-        file_size = os.path.getsize(file_path)
+        stored_path, file_size = store_stream(audio_file.stream)
         
         # Create message
         message = Message(
@@ -421,15 +656,14 @@ def api_upload_audio():
             sender_id=user_id,
             content="🎵 Voice message",
             message_type='audio',
-            file_path=filename,
+            file_path=stored_path,
             file_name="Voice message",
             file_size=file_size,
             file_type='audio/webm',
             audio_duration=duration
         )
         
-        db.session.add(message)
-        db.session.commit()
+        save_file_message(message)
         
         return jsonify({'success': True, 'message': 'Voice message sent'})
     
@@ -437,6 +671,326 @@ def api_upload_audio():
         app.logger.error(f"Error uploading audio: {e}")
         return jsonify({'success': False, 'message': 'Failed to send voice message'})
 
+# Chunked, resumable uploads: init -> PUT chunks at an offset -> finalize
+
+def partial_upload_path(upload):
+    return os.path.join(app.config['UPLOAD_TMP_FOLDER'], f"{upload.id}.part")
+
+def get_upload_session(upload_id, user_id):
+    return UploadSession.query.filter_by(id=upload_id, user_id=user_id).first()
+
+def discard_upload(upload):
+    """Delete an upload session and its partial file"""
+    partial_path = partial_upload_path(upload)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    db.session.delete(upload)
+
+def purge_stale_uploads():
+    """Drop uploads that have not received a chunk within UPLOAD_SESSION_TTL"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'])
+    for upload in UploadSession.query.filter(UploadSession.updated_at < cutoff).all():
+        discard_upload(upload)
+
+def write_chunk(path, stream, offset, max_bytes):
+    """Stream a request body into a partial file at `offset` with bounded memory.
+
+    Returns (bytes_written, sha256 hex digest). Anything past `offset` from an
+    earlier failed attempt is overwritten.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as partial:
+        partial.seek(offset)
+        partial.truncate()
+        while True:
+            block = stream.read(UPLOAD_STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > max_bytes:
+                raise ValueError('Chunk exceeds the remaining file size')
+            digest.update(block)
+            partial.write(block)
+    return written, digest.hexdigest()
+
+def truncate_partial(path, size):
+    if os.path.exists(path):
+        with open(path, 'r+b') as partial:
+            partial.truncate(size)
+
+def upload_status(upload):
+    return {
+        'success': True,
+        'upload_id': upload.id,
+        'file_size': upload.file_size,
+        'received_bytes': upload.received_bytes,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+    }
+
+@app.route('/api/uploads', methods=['POST'])
+def api_upload_init():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    user_id = session['user_id']
+    
+    try:
+        data = request.get_json()
+        conversation_id = data.get('conversation_id')
+        kind = data.get('kind', 'file')
+        file_size = data.get('file_size')
+        
+        if not conversation_id:
+            return jsonify({'success': False, 'message': 'Conversation ID is required'})
+        
+        if not isinstance(file_size, int) or file_size < 0:
+            return jsonify({'success': False, 'message': 'File size is required'})
+        
+        if file_size > app.config['MAX_UPLOAD_SIZE']:
+            return jsonify({'success': False, 'message': 'File is too large'})
+        
+        # Verify user is participant
+        if not is_participant(conversation_id, user_id):
+            return jsonify({'success': False, 'message': 'Access denied'})
+        
+        if kind == 'audio':
+            filename = "Voice message"
+            file_type = 'audio/webm'
+            message_type = 'audio'
+        else:
+            original_name = data.get('file_name', '')
+            if not original_name or not allowed_file(original_name):
+                return jsonify({'success': False, 'message': 'File type not allowed'})
+            filename = secure_filename(original_name) or 'unnamed_file'
+            file_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            message_type = message_type_for(file_type)
+        
+        purge_stale_uploads()
+        
+        upload = UploadSession(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            file_name=filename,
+            file_type=file_type,
+            message_type=message_type,
+            file_size=file_size,
+            audio_duration=float(data.get('duration', 0)) if kind == 'audio' else None
+        )
+        db.session.add(upload)
+        db.session.commit()
+        
+        return jsonify(upload_status(upload))
+    
+    except Exception as e:
+        app.logger.error(f"Error starting upload: {e}")
+        return jsonify({'success': False, 'message': 'Failed to start upload'})
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    upload = get_upload_session(upload_id, session['user_id'])
+    if not upload:
+        return jsonify({'success': False, 'message': 'Upload not found'})
+    
+    # Clients resume from received_bytes after a failure
+    return jsonify(upload_status(upload))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def api_upload_chunk(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    try:
+        upload = get_upload_session(upload_id, session['user_id'])
+        if not upload:
+            return jsonify({'success': False, 'message': 'Upload not found'})
+        
+        offset = request.args.get('offset', type=int)
+        if offset != upload.received_bytes:
+            # Out of sync (e.g. a retried chunk); tell the client where to resume
+            return jsonify({'success': False, 'message': 'Unexpected offset',
+                            'received_bytes': upload.received_bytes})
+        
+        if request.content_length is not None and request.content_length > app.config['UPLOAD_CHUNK_SIZE']:
+            return jsonify({'success': False, 'message': 'Chunk too large',
+                            'received_bytes': upload.received_bytes})
+        
+        partial_path = partial_upload_path(upload)
+        max_bytes = min(app.config['UPLOAD_CHUNK_SIZE'], upload.file_size - offset)
+        try:
+            written, checksum = write_chunk(partial_path, request.stream, offset, max_bytes)
+        except ValueError as e:
+            truncate_partial(partial_path, offset)
+            return jsonify({'success': False, 'message': str(e), 'received_bytes': offset})
+        
+        expected_checksum = request.headers.get('X-Chunk-SHA256')
+        if expected_checksum and expected_checksum.lower() != checksum:
+            truncate_partial(partial_path, offset)
+            return jsonify({'success': False, 'message': 'Checksum mismatch', 'received_bytes': offset})
+        
+        # Only advance if nobody else moved the offset meanwhile
+        advanced = UploadSession.query.filter_by(id=upload.id, received_bytes=offset).update({
+            UploadSession.received_bytes: offset + written,
+            UploadSession.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        if not advanced:
+            db.session.refresh(upload)
+            return jsonify({'success': False, 'message': 'Unexpected offset',
+                            'received_bytes': upload.received_bytes})
+        
+        return jsonify({'success': True, 'received_bytes': offset + written, 'checksum': checksum})
+    
+    except Exception as e:
+        app.logger.error(f"Error receiving upload chunk: {e}")
+        return jsonify({'success': False, 'message': 'Failed to receive chunk'})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def api_upload_finalize(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    try:
+        upload = get_upload_session(upload_id, session['user_id'])
+        if not upload:
+            return jsonify({'success': False, 'message': 'Upload not found'})
+        
+        if upload.received_bytes != upload.file_size:
+            return jsonify({'success': False, 'message': 'Upload incomplete',
+                            'received_bytes': upload.received_bytes})
+        
+        if upload.message_type == 'audio':
+            content = "🎵 Voice message"
+        else:
+            content = f"📎 {upload.file_name}"
+        
+        partial_path = partial_upload_path(upload)
+        if upload.file_size == 0:
+            open(partial_path, 'ab').close()
+        # Chunks can arrive over many requests, so the assembled file is hashed once here.
+        # The partial file stays until the message is committed, so a failed commit can be retried.
+        stored_path = store_file(partial_path, keep_source=True)
+        
+        message = Message(
+            conversation_id=upload.conversation_id,
+            sender_id=upload.user_id,
+            content=content,
+            message_type=upload.message_type,
+            file_path=stored_path,
+            file_name=upload.file_name,
+            file_size=upload.file_size,
+            file_type=upload.file_type,
+            audio_duration=upload.audio_duration
+        )
+        db.session.delete(upload)
+        save_file_message(message)
+        os.remove(partial_path)
+        
+        return jsonify({'success': True, 'message': 'File uploaded successfully', 'message_id': message.id})
+    
+    except Exception as e:
+        app.logger.error(f"Error finalizing upload: {e}")
+        return jsonify({'success': False, 'message': 'Failed to finalize upload'})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def api_upload_abort(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    upload = get_upload_session(upload_id, session['user_id'])
+    if not upload:
+        return jsonify({'success': False, 'message': 'Upload not found'})
+    
+    discard_upload(upload)
+    db.session.commit()
+    return jsonify({'success': True})
+
+def attachment_etag(message_id, variant=None):
+    """Strong ETag for an attachment; the bytes behind a message id never change"""
+    return f"att-{message_id}-{variant}" if variant else f"att-{message_id}"
+
+def set_attachment_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = ATTACHMENT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def attachment_not_modified(message_id, variant=None):
+    """Answer a revalidation with 304 before touching the database or disk.
+
+    A client can only hold this ETag if it was authorized to fetch the file.
+    """
+    etag = attachment_etag(message_id, variant)
+    if request.if_none_match.contains(etag):
+        return set_attachment_cache_headers(app.response_class(status=304), etag)
+    return None
+
+def send_attachment(message, key, variant=None, **kwargs):
+    """send_file with Range, conditional GET and long-lived private caching"""
+    download_url = storage.download_url(
+        key,
+        kwargs.get('download_name'),
+        kwargs.get('mimetype'),
+        kwargs.get('as_attachment', False)
+    )
+    if download_url:
+        return redirect_to_storage(download_url)
+    
+    file_path = storage.local_path(key)
+    mode = app.config['FILE_SERVING_MODE']
+    if mode in ('x-sendfile', 'x-accel-redirect'):
+        return offload_attachment(message, key, file_path, mode, variant, **kwargs)
+    
+    response = send_file(
+        file_path,
+        conditional=True,
+        etag=attachment_etag(message.id, variant),
+        last_modified=message.timestamp,
+        max_age=ATTACHMENT_MAX_AGE,
+        **kwargs
+    )
+    return set_attachment_cache_headers(response, attachment_etag(message.id, variant))
+
+def redirect_to_storage(download_url):
+    """Send the client straight to the object store with a presigned URL.
+
+    The redirect is cached for half the URL's lifetime so the browser keeps
+    reusing one URL, and with it its cached copy of the object.
+    """
+    response = redirect(download_url)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['S3_PRESIGN_EXPIRES'] // 2
+    return response
+
+def offload_attachment(message, key, file_path, mode, variant=None, **kwargs):
+    """Hand the file to the front proxy instead of streaming it from this worker.
+
+    Headers (type, disposition, caching) are built here; the proxy sends the
+    body and answers Range requests itself.
+    """
+    response = werkzeug_send_file(
+        file_path,
+        request.environ,
+        use_x_sendfile=True,
+        conditional=False,
+        etag=attachment_etag(message.id, variant),
+        last_modified=message.timestamp,
+        max_age=ATTACHMENT_MAX_AGE,
+        **kwargs
+    )
+    
+    if mode == 'x-accel-redirect':
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_REDIRECT_PREFIX'] + url_quote(key)
+    
+    return set_attachment_cache_headers(response, attachment_etag(message.id, variant))
+
 @app.route('/api/download/<message_id>')
 def api_download(message_id):
     if 'user_id' not in session:
@@ -444,6 +998,10 @@ def api_download(message_id):
     
     user_id = session['user_id']
     
+    not_modified = attachment_not_modified(message_id)
+    if not_modified:
+        return not_modified
+    
     try:
         # Get message
         message = Message.query.get(message_id)
@@ -451,21 +1009,15 @@ def api_download(message_id):
             return jsonify({'success': False, 'message': 'File not found'}), 404
         
         # Verify user has access to this conversation
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=message.conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(message.conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'}), 403
         
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], message.file_path)
-        
-        if not os.path.exists(file_path):
+        if not storage.exists(message.file_path):
             return jsonify({'success': False, 'message': 'File not found on server'}), 404
         
-        return send_file(
-            file_path,
+        return send_attachment(
+            message,
+            message.file_path,
             as_attachment=True,
             download_name=message.file_name,
             mimetype=message.file_type
@@ -500,7 +1052,7 @@ def api_find_user():
                 'user_id': user.user_id,
                 'name': user.name,
                 'unique_id': user.unique_id,
-                'online': user.online
+                'online': presence.is_online(user.user_id)
             }
         })
     
@@ -562,7 +1114,10 @@ def api_start_private_chat():
         
         db.session.add(participant1)
         db.session.add(participant2)
+        db.session.add(ConversationSummary(conversation_id=conversation.id))
         db.session.commit()
+        invalidate_membership(conversation.id)
+        publish_to_conversation(conversation.id, 'conversation_created', {'conversation_id': conversation.id})
         
         return jsonify({'success': True, 'conversation_id': conversation.id})
     
@@ -613,7 +1168,10 @@ def api_create_group():
                 participant = ConversationParticipant(conversation_id=conversation.id, user_id=member.user_id)
                 db.session.add(participant)
         
+        db.session.add(ConversationSummary(conversation_id=conversation.id))
         db.session.commit()
+        invalidate_membership(conversation.id)
+        publish_to_conversation(conversation.id, 'conversation_created', {'conversation_id': conversation.id})
         
         return jsonify({'success': True, 'conversation_id': conversation.id})
     
@@ -626,13 +1184,18 @@ def api_update_status():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'})
     
+    user_id = session['user_id']
+    
     try:
-        user = User.query.get(session['user_id'])
-        if user:
-            data = request.get_json()
-            user.online = data.get('online', True)
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
+        # Heartbeats only touch in-memory presence; last_seen is persisted in batches
+        data = request.get_json()
+        if data.get('online', True):
+            changed = presence.heartbeat(user_id)
+        else:
+            changed = presence.set_offline(user_id)
+        
+        if changed:
+            publish_presence(user_id, presence.is_online(user_id), presence.last_seen(user_id))
         
         return jsonify({'success': True})
     
@@ -655,22 +1218,46 @@ def api_mark_seen():
         if not message_ids:
             return jsonify({'success': False, 'message': 'Message IDs required'})
         
-        # Mark messages as seen for this user
-        for message_id in message_ids:
-            # Check if already seen
-            existing_seen = MessageSeen.query.filter_by(
-                message_id=message_id,
-                user_id=user_id
-            ).first()
-            
-            if not existing_seen:
-                message_seen = MessageSeen(
-                    message_id=message_id,
-                    user_id=user_id
-                )
-                db.session.add(message_seen)
+        # One query both validates access and finds the messages; ids outside
+        # the caller's conversations simply don't come back
+        message_ids = set(message_ids)
+        seen_messages = db.session.query(
+            Message.id, Message.conversation_id, Message.timestamp
+        ).join(
+            ConversationParticipant,
+            and_(ConversationParticipant.conversation_id == Message.conversation_id,
+                 ConversationParticipant.user_id == user_id)
+        ).filter(
+            Message.id.in_(message_ids)
+        ).all()
+        
+        if len(seen_messages) != len(message_ids):
+            return jsonify({'success': False, 'message': 'Access denied'})
         
+        # Seeing a message means having read everything before it, so only the
+        # newest message per conversation matters for the read watermark. The
+        # watermark update is a single conditional UPDATE, so repeats are no-ops.
+        newest_seen = {}
+        for message_id, conversation_id, timestamp in seen_messages:
+            if conversation_id not in newest_seen or timestamp > newest_seen[conversation_id][1]:
+                newest_seen[conversation_id] = (message_id, timestamp)
+        
+        advanced = [
+            (conversation_id, message_id, timestamp)
+            for conversation_id, (message_id, timestamp) in newest_seen.items()
+            if record_read(conversation_id, user_id, message_id, timestamp)
+        ]
         db.session.commit()
+        
+        # Notify senders so their ticks update without polling
+        for conversation_id, message_id, timestamp in advanced:
+            publish_to_conversation(conversation_id, 'seen', {
+                'conversation_id': conversation_id,
+                'user_id': user_id,
+                'last_read_message_id': message_id,
+                'last_read_at': timestamp.isoformat()
+            })
+        
         return jsonify({'success': True})
     
     except Exception as e:
@@ -679,6 +1266,7 @@ def api_mark_seen():
 
 # Get message seen status for double blue tick display
 @app.route('/api/message_status/<message_id>')
+@replica_reads
 def api_message_status(message_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -690,12 +1278,7 @@ def api_message_status(message_id):
             return jsonify({'success': False, 'message': 'Message not found'})
         
         # Check if user has access to this conversation
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=message.conversation_id,
-            user_id=session['user_id']
-        ).first()
-        
-        if not participant:
+        if not is_participant(message.conversation_id, session['user_id']):
             return jsonify({'success': False, 'message': 'Access denied'})
         
         # Get all participants in the conversation except sender
@@ -704,21 +1287,14 @@ def api_message_status(message_id):
             ConversationParticipant.user_id != message.sender_id
         ).all()
         
-        # Count how many have seen the message
-        seen_count = MessageSeen.query.filter_by(message_id=message_id).count()
+        # Count how many have read up to the message
+        seen_count = sum(1 for p in conversation_participants
+                         if p.last_read_at is not None and p.last_read_at >= message.timestamp)
         total_recipients = len(conversation_participants)
         
-        # Determine status: sent (1 tick), delivered (2 gray ticks), seen (2 blue ticks)
-        if seen_count == 0:
-            status = 'delivered'  # 2 gray ticks
-        elif seen_count == total_recipients:
-            status = 'seen'  # 2 blue ticks
-        else:
-            status = 'partially_seen'  # 2 blue ticks
-        
         return jsonify({
             'success': True,
-            'status': status,
+            'status': tick_status(seen_count, total_recipients),
             'seen_count': seen_count,
             'total_recipients': total_recipients
         })
@@ -727,6 +1303,62 @@ def api_message_status(message_id):
         app.logger.error(f"Error getting message status: {e}")
         return jsonify({'success': False, 'message': 'Failed to get message status'})
 
+# Tick status for many messages at once
+@app.route('/api/message_statuses', methods=['POST'])
+@replica_reads
+def api_message_statuses():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    user_id = session['user_id']
+    
+    try:
+        data = request.get_json()
+        conversation_id = data.get('conversation_id')
+        message_ids = data.get('message_ids', [])
+        
+        if not conversation_id and not message_ids:
+            return jsonify({'success': False, 'message': 'Conversation ID or message IDs required'})
+        
+        recipient = aliased(ConversationParticipant)
+        my_conversations = db.session.query(ConversationParticipant.conversation_id).filter(
+            ConversationParticipant.user_id == user_id
+        )
+        
+        # One grouped pass: every recipient of each message, and how many have read up to it
+        query = db.session.query(
+            Message.id,
+            func.count(recipient.id),
+            func.coalesce(func.sum(case((recipient.last_read_at >= Message.timestamp, 1), else_=0)), 0)
+        ).outerjoin(
+            recipient,
+            and_(recipient.conversation_id == Message.conversation_id, recipient.user_id != Message.sender_id)
+        ).filter(
+            Message.conversation_id.in_(my_conversations)
+        )
+        
+        if conversation_id:
+            query = query.filter(Message.conversation_id == conversation_id)
+        if message_ids:
+            query = query.filter(Message.id.in_(message_ids))
+        else:
+            # Without explicit ids, report on the caller's own messages (the ones that show ticks)
+            query = query.filter(Message.sender_id == user_id)
+        
+        statuses = {}
+        for message_id, total_recipients, seen_count in query.group_by(Message.id):
+            statuses[message_id] = {
+                'status': tick_status(seen_count, total_recipients),
+                'seen_count': seen_count,
+                'total_recipients': total_recipients
+            }
+        
+        return jsonify({'success': True, 'statuses': statuses})
+    
+    except Exception as e:
+        app.logger.error(f"Error getting message statuses: {e}")
+        return jsonify({'success': False, 'message': 'Failed to get message statuses'})
+
 # Image preview endpoint for WhatsApp-like image viewing
 @app.route('/api/image/<message_id>')
 def api_view_image(message_id):
@@ -735,6 +1367,15 @@ def api_view_image(message_id):
     
     user_id = session['user_id']
     
+    # Optional resized variant (?size=thumb|preview) for chat bubbles and the preview modal
+    size = request.args.get('size')
+    if size and size not in THUMBNAIL_SIZES:
+        return jsonify({'success': False, 'message': 'Invalid size'}), 400
+    
+    not_modified = attachment_not_modified(message_id, size)
+    if not_modified:
+        return not_modified
+    
     try:
         # Get message
         message = Message.query.get(message_id)
@@ -742,21 +1383,116 @@ def api_view_image(message_id):
             return jsonify({'success': False, 'message': 'Image not found'}), 404
         
         # Verify user has access to this conversation
-        participant = ConversationParticipant.query.filter_by(
-            conversation_id=message.conversation_id,
-            user_id=user_id
-        ).first()
-        
-        if not participant:
+        if not is_participant(message.conversation_id, user_id):
             return jsonify({'success': False, 'message': 'Access denied'}), 403
         
         # Return image file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], message.file_path)
-        if os.path.exists(file_path):
-            return send_file(file_path)
-        else:
+        if not storage.exists(message.file_path):
             return jsonify({'success': False, 'message': 'File not found on server'}), 404
+        
+        if size and thumbnails_supported(message.file_type, message.file_size):
+            variant_key = thumbnail_key(message.file_path, size)
+            try:
+                if not storage.exists(variant_key):
+                    # Not rendered yet (older upload or worker still busy): render just this size now
+                    generate_thumbnails(message.file_path, [size])
+                if storage.exists(variant_key):  # Not when the source has too many pixels
+                    return send_attachment(message, variant_key, variant=size, mimetype='image/webp')
+            except Exception as e:
+                app.logger.warning(f"Could not render {size} for image {message.id}, sending original: {e}")
+        
+        return send_attachment(message, message.file_path, mimetype=message.file_type, download_name=message.file_name)
     
     except Exception as e:
         app.logger.error(f"Error viewing image: {e}")
         return jsonify({'success': False, 'message': 'Failed to load image'}), 500
+
+def wait_request_options(data):
+    """(known versions, timeout) from a /api/wait request body"""
+    if not isinstance(data, dict):
+        raise ValueError('Invalid request')
+    known_versions = data.get('versions') or {}
+    if not isinstance(known_versions, dict):
+        raise ValueError('versions must map conversation ids to versions')
+    timeout = data.get('timeout', LONG_POLL_TIMEOUT)
+    if not isinstance(timeout, (int, float)):
+        raise ValueError('timeout must be a number of seconds')
+    return known_versions, max(0, min(timeout, MAX_LONG_POLL_TIMEOUT))
+
+# Long poll for clients without an event stream: returns as soon as one of the user's
+# conversations moves past the versions the client knows, or after the timeout
+@app.route('/api/wait', methods=['POST'])
+def api_wait():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    user_id = session['user_id']
+    
+    try:
+        try:
+            known_versions, timeout = wait_request_options(request.get_json(silent=True) or {})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        # Subscribe before the first check so a change between the two isn't missed
+        listener = broker.subscribe(user_id)
+        try:
+            deadline = time.monotonic() + timeout
+            changed = changed_versions(user_id, known_versions)
+            # Waiting holds no database connection; only change events trigger another check
+            db.session.close()
+            while not changed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event, _ = listener.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event in CHANGE_EVENTS:
+                    changed = changed_versions(user_id, known_versions)
+                    db.session.close()
+        finally:
+            broker.unsubscribe(user_id, listener)
+        
+        return jsonify({'success': True, 'changed': changed})
+    
+    except Exception as e:
+        app.logger.error(f"Error waiting for changes: {e}")
+        return jsonify({'success': False, 'message': 'Failed to wait for changes'})
+
+# Server-sent event stream that replaces per-second polling
+@app.route('/api/events')
+def api_events():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    user_id = session['user_id']
+    listener = broker.subscribe(user_id)
+    
+    def stream():
+        try:
+            # Ask the browser to reconnect quickly if the stream drops
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = listener.get(timeout=EVENT_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    if listener.overflowed:
+                        break
+                    # An open stream keeps the user's presence alive
+                    if presence.stream_heartbeat_due(user_id, EVENT_STREAM_KEEPALIVE):
+                        stream_heartbeat(user_id)
+                    yield ": keep-alive\n\n"
+                    continue
+                if listener.overflowed:
+                    # Events were dropped; ending the stream makes EventSource reconnect and resync
+                    break
+                yield format_sse(event, data)
+        finally:
+            broker.unsubscribe(user_id, listener)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
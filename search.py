@@ -0,0 +1,101 @@
+import re
+import click
+from sqlalchemy import text
+from app import app, db
+
+# Full-text message search. SQLite keeps a separate FTS5 table that the
+# message-writing routes feed through index_message(); Postgres uses a
+# generated tsvector column with a GIN index, which stays in sync by itself.
+# Voice messages have no searchable text and are left out of both.
+
+def search_dialect():
+    return db.engine.dialect.name
+
+def ensure_search_index():
+    """Create the full-text index if it is missing, backfilling existing messages"""
+    dialect = search_dialect()
+    if dialect == 'sqlite':
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_search'"
+        )).first()
+        if exists:
+            return
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE message_search USING fts5("
+            "content, message_id UNINDEXED, conversation_id UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        rebuild_search_index()
+    elif dialect == 'postgresql':
+        db.session.execute(text(
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+            "to_tsvector('simple', CASE WHEN message_type = 'audio' THEN '' ELSE coalesce(content, '') END)"
+            ") STORED"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)"
+        ))
+    db.session.commit()
+
+def rebuild_search_index():
+    """Re-index every message (SQLite only; the Postgres column is generated)"""
+    if search_dialect() != 'sqlite':
+        return 0
+    db.session.execute(text("DELETE FROM message_search"))
+    result = db.session.execute(text(
+        "INSERT INTO message_search (content, message_id, conversation_id) "
+        "SELECT content, id, conversation_id FROM messages "
+        "WHERE content IS NOT NULL AND message_type != 'audio'"
+    ))
+    return result.rowcount
+
+def index_message(message):
+    """Add a new message to the search index in the caller's transaction"""
+    if search_dialect() != 'sqlite' or not message.content or message.message_type == 'audio':
+        return
+    db.session.execute(text(
+        "INSERT INTO message_search (content, message_id, conversation_id) "
+        "VALUES (:content, :message_id, :conversation_id)"
+    ), {'content': message.content, 'message_id': message.id, 'conversation_id': message.conversation_id})
+
+def search_terms(query):
+    """Split user input into plain word tokens, so search syntax can't be injected"""
+    return re.findall(r'[^\W_]+', query)
+
+def search_message_ids(user_id, query, conversation_id=None, limit=20, offset=0):
+    """Best-matching message ids in the user's conversations, best first.
+
+    Every term must match, each as a word prefix ("meet" finds "meeting").
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    params = {'user_id': user_id, 'conversation_id': conversation_id, 'limit': limit, 'offset': offset}
+    scope = "conversation_id IN (SELECT conversation_id FROM conversation_participants WHERE user_id = :user_id)"
+    if conversation_id:
+        scope += " AND conversation_id = :conversation_id"
+
+    dialect = search_dialect()
+    if dialect == 'sqlite':
+        params['query'] = ' '.join(f'"{term}"*' for term in terms)
+        sql = ("SELECT message_id FROM message_search "
+               "WHERE message_search MATCH :query AND " + scope +
+               " ORDER BY bm25(message_search) LIMIT :limit OFFSET :offset")
+    elif dialect == 'postgresql':
+        params['query'] = ' & '.join(f"{term}:*" for term in terms)
+        sql = ("SELECT id FROM messages "
+               "WHERE search_vector @@ to_tsquery('simple', :query) AND " + scope +
+               " ORDER BY ts_rank_cd(search_vector, to_tsquery('simple', :query)) DESC, timestamp DESC"
+               " LIMIT :limit OFFSET :offset")
+    else:
+        raise RuntimeError(f"Full-text search is not supported on {dialect}")
+
+    return [message_id for (message_id,) in db.session.execute(text(sql), params)]
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text message search index from the messages table."""
+    indexed = rebuild_search_index()
+    db.session.commit()
+    click.echo(f"Indexed {indexed} messages")
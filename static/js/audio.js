@@ -333,23 +333,13 @@ async function playAudioMessage(messageId) {
         let audio = audioElements.get(messageId);
         
         if (!audio) {
-            // Fetch audio data
-            const response = await fetch(`/api/download/${messageId}`);
-            if (!response.ok) {
-                throw new Error('Failed to load audio');
-            }
-            
-            const blob = await response.blob();
-            const audioUrl = URL.createObjectURL(blob);
-            
-            // Create audio element
-            audio = new Audio(audioUrl);
+            // Stream straight from the server; range requests let it start and seek early
+            audio = new Audio(`/api/download/${messageId}`);
             audioElements.set(messageId, audio);
             
             // Update play button when audio ends
             audio.addEventListener('ended', () => {
                 updateAudioButton(messageId, false);
-                URL.revokeObjectURL(audioUrl);
                 audioElements.delete(messageId);
             });
             
@@ -358,7 +348,6 @@ async function playAudioMessage(messageId) {
                 console.error('Audio playback error:', e);
                 MainJS.showError('Failed to play audio message');
                 updateAudioButton(messageId, false);
-                URL.revokeObjectURL(audioUrl);
                 audioElements.delete(messageId);
             });
         }
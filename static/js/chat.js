@@ -1,7 +1,14 @@
 // Chat functionality
 let conversations = [];
 let messages = {};
-let pollingInterval;
+let longPoll;
+let conversationVersions = {};
+let eventSource;
+let olderMessagesAvailable = {};
+let loadingOlderMessages = false;
+
+// Messages fetched per history page
+const MESSAGE_PAGE_SIZE = 50;
 
 // Mobile sidebar functionality
 function toggleMobileSidebar() {
@@ -53,7 +60,7 @@ async function initializeChat() {
         
         // Load fresh data
         await loadConversations();
-        startPolling();
+        startEventStream();
         setupEventListeners();
         
         console.log('Chat initialized successfully');
@@ -81,6 +88,16 @@ function setupEventListeners() {
     if (groupChatForm) {
         groupChatForm.addEventListener('submit', handleCreateGroup);
     }
+    
+    // Load older history when scrolled to the top
+    const chatMessages = document.getElementById('chatMessages');
+    if (chatMessages) {
+        chatMessages.addEventListener('scroll', () => {
+            if (chatMessages.scrollTop < 50 && window.currentConversation) {
+                loadOlderMessages(window.currentConversation);
+            }
+        });
+    }
 }
 
 async function loadConversations() {
@@ -89,6 +106,10 @@ async function loadConversations() {
         
         if (response.success) {
             conversations = response.conversations || [];
+            // Baseline for /api/wait, so the fallback only wakes on newer changes
+            conversations.forEach(conv => {
+                conversationVersions[conv.id] = conv.version;
+            });
             renderConversations();
         } else {
             console.warn('Failed to load conversations:', response.message);
@@ -141,7 +162,10 @@ function renderConversations() {
                     <div class="flex-grow-1">
                         <div class="d-flex justify-content-between align-items-start">
                             <div class="fw-bold">${MainJS.escapeHtml(conv.name)}</div>
-                            ${lastMessage ? `<small class="text-muted">${MainJS.formatTime(lastMessage.timestamp)}</small>` : ''}
+                            <div class="text-end">
+                                ${lastMessage ? `<small class="text-muted">${MainJS.formatTime(lastMessage.timestamp)}</small>` : ''}
+                                ${conv.unread_count > 0 && !isActive ? `<span class="badge rounded-pill bg-success ms-1">${conv.unread_count}</span>` : ''}
+                            </div>
                         </div>
                         ${lastMessage ? `
                             <div class="text-muted small text-truncate">
@@ -170,6 +194,7 @@ async function selectConversation(conversationId) {
         }
         
         window.currentConversation = conversationId;
+        conversation.unread_count = 0;
         
         // Update UI
         document.querySelectorAll('.conversation-item').forEach(item => {
@@ -219,12 +244,25 @@ async function selectConversation(conversationId) {
 async function loadMessages(conversationId) {
     try {
         console.log('Loading messages for conversation ID:', conversationId);
-        const response = await MainJS.apiRequest(`/api/messages/${conversationId}`);
+        // Only the newest page; older history is fetched on scroll
+        const response = await MainJS.apiRequest(`/api/messages/${conversationId}?limit=${MESSAGE_PAGE_SIZE}`);
         console.log('Messages API response:', response);
         
         if (response.success) {
-            messages[conversationId] = response.messages || [];
-            console.log('Messages loaded:', response.messages.length);
+            const page = response.messages || [];
+            const existing = messages[conversationId] || [];
+            
+            // Keep any older pages the user already scrolled back through
+            const oldest = page.length > 0 ? page[0].timestamp : null;
+            const olderLoaded = oldest ? existing.filter(m => m.timestamp < oldest) : [];
+            messages[conversationId] = olderLoaded.concat(page);
+            if (olderLoaded.length === 0) {
+                olderMessagesAvailable[conversationId] = response.has_more;
+            } else if (olderMessagesAvailable[conversationId] === undefined) {
+                // Cached history may have gaps above it; let the next scroll find out
+                olderMessagesAvailable[conversationId] = true;
+            }
+            console.log('Messages loaded:', page.length);
             
             // Save messages to local storage
             saveMessagesToLocalStorage(conversationId, messages[conversationId]);
@@ -246,6 +284,58 @@ async function loadMessages(conversationId) {
     }
 }
 
+// Fetch only messages newer than the last one we have
+async function loadNewMessages(conversationId) {
+    const existing = messages[conversationId];
+    if (!existing || existing.length === 0) {
+        return loadMessages(conversationId);
+    }
+    
+    const lastId = existing[existing.length - 1].id;
+    const response = await MainJS.apiRequest(`/api/messages/${conversationId}?since=${encodeURIComponent(lastId)}`);
+    
+    if (response.success && response.messages.length > 0) {
+        const knownIds = new Set(existing.map(m => m.id));
+        response.messages.forEach(msg => {
+            if (!knownIds.has(msg.id)) {
+                existing.push(msg);
+            }
+        });
+        saveMessagesToLocalStorage(conversationId, existing);
+        renderMessages(conversationId);
+    }
+}
+
+// Page backwards through history, keeping the current scroll position
+async function loadOlderMessages(conversationId) {
+    const existing = messages[conversationId];
+    if (loadingOlderMessages || !olderMessagesAvailable[conversationId] || !existing || existing.length === 0) {
+        return;
+    }
+    
+    loadingOlderMessages = true;
+    try {
+        const firstId = existing[0].id;
+        const response = await MainJS.apiRequest(
+            `/api/messages/${conversationId}?before=${encodeURIComponent(firstId)}&limit=${MESSAGE_PAGE_SIZE}`
+        );
+        
+        if (response.success && window.currentConversation === conversationId) {
+            olderMessagesAvailable[conversationId] = response.has_more;
+            messages[conversationId] = response.messages.concat(existing);
+            
+            const chatMessages = document.getElementById('chatMessages');
+            const previousHeight = chatMessages.scrollHeight;
+            renderMessages(conversationId);
+            chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+        }
+    } catch (error) {
+        console.error('Failed to load older messages:', error);
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
 function renderMessages(conversationId) {
     console.log('Rendering messages for conversation:', conversationId);
     const chatMessages = document.getElementById('chatMessages');
@@ -327,7 +417,8 @@ function renderImageMessage(msg, messageClass) {
                 ${!isCurrentUser && getConversationType(window.currentConversation) === 'group' ? 
                     `<div class="small text-muted mb-1">${MainJS.escapeHtml(msg.sender_name)}</div>` : ''}
                 <div class="image-message ${messageClass}" onclick="openImagePreview('${msg.id}')">
-                    <img src="/api/image/${msg.id}" alt="${MainJS.escapeHtml(msg.file_name || 'Image')}" 
+                    <img src="/api/image/${msg.id}?size=thumb" alt="${MainJS.escapeHtml(msg.file_name || 'Image')}" 
+                         ${msg.image_width && msg.image_height ? `width="${msg.image_width}" height="${msg.image_height}"` : ''}
                          class="message-image" loading="lazy">
                     <div class="image-overlay">
                         <i class="fas fa-search-plus"></i>
@@ -487,7 +578,10 @@ async function handleSendMessage(event) {
             if (!messages[window.currentConversation]) {
                 messages[window.currentConversation] = [];
             }
-            messages[window.currentConversation].push(response.message);
+            // The new_message event for our own message may have arrived before this response
+            if (!messages[window.currentConversation].some(m => m.id === response.message.id)) {
+                messages[window.currentConversation].push(response.message);
+            }
             
             // Save messages to local storage
             saveMessagesToLocalStorage(window.currentConversation, messages[window.currentConversation]);
@@ -521,22 +615,13 @@ async function downloadFile(messageId) {
 // Audio playback function
 async function playAudioMessage(messageId) {
     try {
-        const response = await fetch(`/api/download/${messageId}`);
-        if (response.ok) {
-            const blob = await response.blob();
-            const audioUrl = URL.createObjectURL(blob);
-            const audio = new Audio(audioUrl);
-            
-            audio.play().catch(error => {
-                console.error('Error playing audio:', error);
-                MainJS.showError('Failed to play audio');
-            });
-            
-            // Clean up URL when audio ends
-            audio.addEventListener('ended', () => {
-                URL.revokeObjectURL(audioUrl);
-            });
-        }
+        // Stream straight from the server; range requests let it start and seek early
+        const audio = new Audio(`/api/download/${messageId}`);
+        
+        audio.play().catch(error => {
+            console.error('Error playing audio:', error);
+            MainJS.showError('Failed to play audio');
+        });
     } catch (error) {
         console.error('Error playing audio:', error);
         MainJS.showError('Failed to play audio');
@@ -554,11 +639,13 @@ function getConversationType(conversationId) {
 }
 
 async function markMessagesAsSeen(conversationId) {
+    // Get all message IDs from current conversation
+    const conversationMessages = messages[conversationId] || [];
+    await markMessageIdsAsSeen(conversationMessages.map(msg => msg.id));
+}
+
+async function markMessageIdsAsSeen(messageIds) {
     try {
-        // Get all message IDs from current conversation
-        const conversationMessages = messages[conversationId] || [];
-        const messageIds = conversationMessages.map(msg => msg.id);
-        
         if (messageIds.length > 0) {
             await MainJS.apiRequest('/api/mark_seen', {
                 method: 'POST',
@@ -572,22 +659,187 @@ async function markMessagesAsSeen(conversationId) {
     }
 }
 
-function startPolling() {
-    // Poll for new messages every 1 second for instant response like your original code
-    pollingInterval = setInterval(async () => {
+// Server push: receive new messages, seen receipts and presence as they happen
+function startEventStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    
+    eventSource = new EventSource('/api/events');
+    let connectedBefore = false;
+    
+    eventSource.addEventListener('open', () => {
+        // Push is (back) up - stop the fallback and resync anything we missed while disconnected
+        // (the server also ends the stream when it had to drop events for us)
+        stopPolling();
+        if (connectedBefore) {
+            loadConversations();
+            if (window.currentConversation) {
+                loadMessages(window.currentConversation);
+            }
+        }
+        connectedBefore = true;
+    });
+    
+    eventSource.addEventListener('error', () => {
+        // EventSource reconnects on its own; poll until it does
+        if (!longPoll) {
+            startPolling();
+        }
+    });
+    
+    eventSource.addEventListener('new_message', event => handleNewMessageEvent(JSON.parse(event.data)));
+    eventSource.addEventListener('seen', event => handleSeenEvent(JSON.parse(event.data)));
+    eventSource.addEventListener('message_updated', event => handleMessageUpdatedEvent(JSON.parse(event.data)));
+    eventSource.addEventListener('presence', event => handlePresenceEvent(JSON.parse(event.data)));
+    eventSource.addEventListener('conversation_created', () => loadConversations());
+}
+
+function handleNewMessageEvent(message) {
+    const conversationId = message.conversation_id;
+    
+    // Unknown conversation (e.g. someone just added us to a group)
+    if (!conversations.some(c => c.id === conversationId)) {
+        loadConversations();
+        return;
+    }
+    
+    if (messages[conversationId] && !messages[conversationId].some(m => m.id === message.id)) {
+        messages[conversationId].push(message);
+        saveMessagesToLocalStorage(conversationId, messages[conversationId]);
+        
+        if (window.currentConversation === conversationId) {
+            renderMessages(conversationId);
+        }
+    }
+    
+    // The chat is open, so the message is read as soon as it arrives
+    if (window.currentConversation === conversationId && message.sender_id !== getCurrentUserId()) {
+        markMessageIdsAsSeen([message.id]);
+    }
+    
+    // Move the conversation to the top with the new preview
+    const conversation = conversations.find(c => c.id === conversationId);
+    if (message.sender_id !== getCurrentUserId() && window.currentConversation !== conversationId) {
+        conversation.unread_count = (conversation.unread_count || 0) + 1;
+    }
+    conversation.last_message = {
+        content: message.content,
+        timestamp: message.timestamp,
+        sender_name: message.sender_name
+    };
+    conversations.sort((a, b) => {
+        const aTime = a.last_message ? a.last_message.timestamp : '';
+        const bTime = b.last_message ? b.last_message.timestamp : '';
+        return bTime.localeCompare(aTime);
+    });
+    renderConversations();
+}
+
+function handleMessageUpdatedEvent(update) {
+    // Attachment processing finished: image dimensions and audio duration are known now
+    const conversationMessages = messages[update.conversation_id];
+    const message = conversationMessages && conversationMessages.find(m => m.id === update.id);
+    if (!message) return;
+    
+    ['image_width', 'image_height', 'audio_duration'].forEach(field => {
+        if (update[field] !== null && update[field] !== undefined) {
+            message[field] = update[field];
+        }
+    });
+    saveMessagesToLocalStorage(update.conversation_id, conversationMessages);
+    
+    if (window.currentConversation === update.conversation_id) {
+        renderMessages(update.conversation_id);
+    }
+}
+
+function handleSeenEvent(receipt) {
+    const conversationMessages = messages[receipt.conversation_id];
+    if (!conversationMessages) return;
+    
+    // The reader's watermark covers every earlier message from someone else
+    conversationMessages.forEach(msg => {
+        if (msg.sender_id !== receipt.user_id &&
+            msg.timestamp <= receipt.last_read_at &&
+            !msg.seen_by.includes(receipt.user_id)) {
+            msg.seen_by.push(receipt.user_id);
+        }
+    });
+    
+    if (window.currentConversation === receipt.conversation_id) {
+        renderMessages(receipt.conversation_id);
+    }
+}
+
+function handlePresenceEvent(presence) {
+    let changed = false;
+    
+    conversations.forEach(conv => {
+        const participant = conv.participants.find(p => p.id === presence.user_id);
+        if (!participant) return;
+        
+        participant.online = presence.online;
+        if (conv.type === 'private') {
+            conv.online = presence.online;
+        } else {
+            conv.online = conv.participants.some(p => p.id !== getCurrentUserId() && p.online);
+        }
+        changed = true;
+    });
+    
+    if (changed) {
+        renderConversations();
+        if (window.currentConversation) {
+            updateChatHeader(window.currentConversation);
+        }
+    }
+}
+
+// Fallback when the event stream is unavailable: long-poll until a conversation changes
+async function startPolling() {
+    const controller = new AbortController();
+    longPoll = controller;
+    
+    while (longPoll === controller) {
         try {
-            // Reload conversations to get latest messages
-            await loadConversations();
+            const response = await MainJS.apiRequest('/api/wait', {
+                method: 'POST',
+                body: JSON.stringify({ versions: conversationVersions }),
+                signal: controller.signal
+            });
+            if (!response.success) {
+                throw new Error(response.message);
+            }
             
-            // If a conversation is selected, reload its messages
-            if (window.currentConversation) {
-                await loadMessages(window.currentConversation);
-                markMessagesAsSeen(window.currentConversation);
+            const changed = response.changed || {};
+            if (Object.keys(changed).length > 0) {
+                Object.assign(conversationVersions, changed);
+                await loadConversations();
+                
+                // If the open conversation changed, fetch only what's new
+                if (window.currentConversation && window.currentConversation in changed) {
+                    await loadNewMessages(window.currentConversation);
+                    markMessagesAsSeen(window.currentConversation);
+                }
             }
         } catch (error) {
-            console.error('Polling error:', error);
+            if (controller.signal.aborted) {
+                break;
+            }
+            console.error('Long poll error:', error);
+            // Back off before retrying so a failing server isn't hammered
+            await new Promise(resolve => setTimeout(resolve, 5000));
         }
-    }, 1000);
+    }
+}
+
+function stopPolling() {
+    if (longPoll) {
+        longPoll.abort();
+        longPoll = null;
+    }
 }
 
 // New chat functions
@@ -762,7 +1014,7 @@ function openImagePreview(messageId) {
         existingModal.remove();
     }
     
-    const imageUrl = `/api/image/${messageId}`;
+    const imageUrl = `/api/image/${messageId}?size=preview`;
     
     // Create simple modal with minimal interference
     const modal = document.createElement('div');
@@ -853,16 +1105,26 @@ async function updateMessageStatuses() {
     
     // Only check status for messages sent by current user
     const sentMessages = conversationMessages.filter(msg => msg.sender_id === currentUserId);
+    if (sentMessages.length === 0) return;
     
-    for (const message of sentMessages) {
-        try {
-            const response = await MainJS.apiRequest(`/api/message_status/${message.id}`);
-            if (response.success) {
-                message.status = response.status;
-            }
-        } catch (error) {
-            console.error('Error updating message status:', error);
+    try {
+        // One batched request for the whole view
+        const response = await MainJS.apiRequest('/api/message_statuses', {
+            method: 'POST',
+            body: JSON.stringify({
+                conversation_id: window.currentConversation,
+                message_ids: sentMessages.map(msg => msg.id)
+            })
+        });
+        if (response.success) {
+            sentMessages.forEach(message => {
+                if (response.statuses[message.id]) {
+                    message.status = response.statuses[message.id].status;
+                }
+            });
         }
+    } catch (error) {
+        console.error('Error updating message status:', error);
     }
 }
 
@@ -1010,7 +1272,8 @@ async function findUser() {
 
 // Cleanup on page unload
 window.addEventListener('beforeunload', () => {
-    if (pollingInterval) {
-        clearInterval(pollingInterval);
+    stopPolling();
+    if (eventSource) {
+        eventSource.close();
     }
 });
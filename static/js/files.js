@@ -116,10 +116,10 @@ async function uploadFile(file) {
         return;
     }
     
-    // Validate file size (100MB limit)
-    const maxSize = 100 * 1024 * 1024; // 100MB
+    // Validate file size (1GB limit, uploaded in resumable chunks)
+    const maxSize = 1024 * 1024 * 1024; // 1GB
     if (file.size > maxSize) {
-        MainJS.showError(`File "${file.name}" is too large. Maximum size is 100MB.`);
+        MainJS.showError(`File "${file.name}" is too large. Maximum size is 1GB.`);
         return;
     }
     
@@ -140,13 +140,8 @@ async function uploadFile(file) {
     const progressId = createProgressUI(file);
     
     try {
-        // Create form data
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('conversation_id', window.currentConversation);
-        
-        // Upload with progress tracking
-        const response = await uploadWithProgress(formData, progressId);
+        // Upload in chunks with progress tracking
+        const response = await uploadInChunks(file, window.currentConversation, progressId);
         
         if (response.success) {
             updateProgressUI(progressId, 100, 'Upload complete');
@@ -183,41 +178,81 @@ async function uploadFile(file) {
     }
 }
 
-function uploadWithProgress(formData, progressId) {
-    return new Promise((resolve, reject) => {
-        const xhr = new XMLHttpRequest();
-        
-        // Track upload progress
-        xhr.upload.addEventListener('progress', (event) => {
-            if (event.lengthComputable) {
-                const percentComplete = (event.loaded / event.total) * 100;
-                updateProgressUI(progressId, percentComplete, 'Uploading...');
+// Chunked, resumable upload: init, PUT each chunk at its offset, then finalize
+const UPLOAD_CHUNK_RETRIES = 5;
+
+async function uploadInChunks(file, conversationId, progressId) {
+    const init = await MainJS.apiRequest('/api/uploads', {
+        method: 'POST',
+        body: JSON.stringify({
+            conversation_id: conversationId,
+            file_name: file.name,
+            file_size: file.size
+        })
+    });
+    if (!init.success) {
+        return init;
+    }
+    
+    const uploadId = init.upload_id;
+    let offset = init.received_bytes;
+    let failures = 0;
+    
+    while (offset < file.size) {
+        const chunk = file.slice(offset, offset + init.chunk_size);
+        let result;
+        try {
+            const headers = { 'Content-Type': 'application/octet-stream' };
+            const checksum = await sha256Hex(chunk);
+            if (checksum) {
+                headers['X-Chunk-SHA256'] = checksum;
             }
-        });
-        
-        // Handle completion
-        xhr.addEventListener('load', () => {
-            try {
-                const response = JSON.parse(xhr.responseText);
-                resolve(response);
-            } catch (error) {
-                reject(new Error('Invalid response format'));
+            
+            const response = await fetch(`/api/uploads/${uploadId}?offset=${offset}`, {
+                method: 'PUT',
+                headers,
+                body: chunk
+            });
+            result = await response.json();
+        } catch (error) {
+            if (++failures > UPLOAD_CHUNK_RETRIES) {
+                throw error;
             }
-        });
-        
-        // Handle errors
-        xhr.addEventListener('error', () => {
-            reject(new Error('Network error during upload'));
-        });
-        
-        xhr.addEventListener('abort', () => {
-            reject(new Error('Upload cancelled'));
-        });
+            
+            // Back off, then ask the server how much it actually has
+            updateProgressUI(progressId, (offset / file.size) * 100, 'Connection lost, resuming...');
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await MainJS.apiRequest(`/api/uploads/${uploadId}`).catch(() => null);
+            if (status && status.success) {
+                offset = status.received_bytes;
+            }
+            continue;
+        }
         
-        // Start upload
-        xhr.open('POST', '/api/upload_file');
-        xhr.send(formData);
-    });
+        if (result.success) {
+            failures = 0;
+        } else if (result.received_bytes === undefined) {
+            // Upload gone, signed out, ...: retrying can't help
+            throw new Error(result.message);
+        } else if (++failures > UPLOAD_CHUNK_RETRIES) {
+            throw new Error(result.message);
+        }
+        // On failure the server reports where to resume from
+        offset = result.received_bytes;
+        updateProgressUI(progressId, (offset / file.size) * 100, 'Uploading...');
+    }
+    
+    updateProgressUI(progressId, 100, 'Processing...');
+    return MainJS.apiRequest(`/api/uploads/${uploadId}/finalize`, { method: 'POST' });
+}
+
+async function sha256Hex(blob) {
+    // SubtleCrypto is only available in secure contexts; the checksum is optional
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
 }
 
 function createProgressUI(file) {
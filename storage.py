@@ -0,0 +1,183 @@
+import os
+import shutil
+import uuid
+from urllib.parse import quote
+from app import app
+
+# Attachments are addressed by key (Message.file_path, e.g. blobs/ab/cd/<sha256>).
+# STORAGE_BACKEND picks where the bytes live; uploads are still staged on local
+# disk (UPLOAD_TMP_FOLDER) before being handed to the backend.
+
+class LocalStorage:
+    """Keys map to files under a root directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def touch(self, key):
+        """Refresh a key's modification time; raises FileNotFoundError if it is gone"""
+        os.utime(self.local_path(key))
+
+    def modified_at(self, key):
+        """Modification time in epoch seconds, or None if the key doesn't exist"""
+        try:
+            return os.path.getmtime(self.local_path(key))
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, key, source_path, keep_source=False):
+        """Store a complete local file under a key, moving it unless keep_source is set"""
+        target = self.local_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not keep_source:
+            os.replace(source_path, target)
+            return
+        # Copy under a temporary name and rename so readers never see a partial file
+        partial = f"{target}.{uuid.uuid4()}.tmp"
+        try:
+            os.link(source_path, partial)
+        except OSError:
+            shutil.copyfile(source_path, partial)
+        os.replace(partial, target)
+
+    def put_stream(self, key, stream):
+        target = self.local_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f"{target}.{uuid.uuid4()}.tmp"
+        with open(partial, 'wb') as out:
+            shutil.copyfileobj(stream, out)
+        os.replace(partial, target)
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def delete(self, key):
+        path = self.local_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def list(self, prefix):
+        """Yield (key, modified epoch seconds) for every key under a prefix"""
+        for directory, _, file_names in os.walk(self.local_path(prefix)):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield key, os.path.getmtime(path)
+
+    def download_url(self, key, file_name, content_type, as_attachment):
+        """Local files are sent by this app (or its front proxy), never by URL"""
+        return None
+
+
+class S3Storage:
+    """Keys map to objects in an S3-compatible bucket (AWS S3, MinIO, R2, ...)"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, presign_expires=3600,
+                 multipart_chunk_size=8 * 1024 * 1024):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.presign_expires = presign_expires
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        # Large files go up as parallel multipart uploads, streamed from disk part by part
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunk_size,
+                                              multipart_chunksize=multipart_chunk_size)
+
+    def object_key(self, key):
+        return self.prefix + key
+
+    def local_path(self, key):
+        return None
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def touch(self, key):
+        """Refresh LastModified with an in-place copy; raises FileNotFoundError if it is gone"""
+        object_key = self.object_key(key)
+        try:
+            self.client.copy_object(Bucket=self.bucket, Key=object_key,
+                                    CopySource={'Bucket': self.bucket, 'Key': object_key},
+                                    MetadataDirective='REPLACE')
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(key)
+            raise
+
+    def modified_at(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))['LastModified'].timestamp()
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def put_file(self, key, source_path, keep_source=False):
+        self.client.upload_file(source_path, self.bucket, self.object_key(key), Config=self.transfer_config)
+        if not keep_source:
+            os.remove(source_path)
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self.object_key(key), Config=self.transfer_config)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix)):
+            for item in page.get('Contents', ()):
+                yield item['Key'][len(self.prefix):], item['LastModified'].timestamp()
+
+    def download_url(self, key, file_name, content_type, as_attachment):
+        """Presigned GET so the client downloads straight from the bucket"""
+        disposition = 'attachment' if as_attachment else 'inline'
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': self.object_key(key),
+            'ResponseContentType': content_type or 'application/octet-stream',
+            'ResponseContentDisposition': f"{disposition}; filename*=UTF-8''{quote(file_name or key.rsplit('/', 1)[-1])}",
+            # Keys are content-addressed, so the object behind a URL never changes
+            'ResponseCacheControl': 'private, max-age=31536000, immutable'
+        }, ExpiresIn=self.presign_expires)
+
+
+def create_storage(config):
+    backend = config['STORAGE_BACKEND']
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            presign_expires=config['S3_PRESIGN_EXPIRES'],
+            multipart_chunk_size=config['UPLOAD_CHUNK_SIZE']
+        )
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {backend!r}")
+
+
+storage = create_storage(app.config)
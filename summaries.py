@@ -0,0 +1,176 @@
+from datetime import datetime
+import click
+from sqlalchemy import func, select, or_, inspect, text
+from sqlalchemy.orm import aliased
+from app import app, db
+from models import User, Conversation, ConversationParticipant, ConversationSummary, Message
+
+def message_preview(content, message_type, file_name):
+    """Short text shown for a message in the conversation list"""
+    return content or (f"📎 {file_name}" if message_type == 'file' else
+                       "🎵 Voice message" if message_type == 'audio' else
+                       "📷 Image" if message_type == 'image' else content)
+
+def unread_count_after(conversation_id, user_id, timestamp):
+    """SQL expression counting messages from others newer than a read position"""
+    query = select(func.count(Message.id)).where(
+        Message.conversation_id == conversation_id,
+        Message.sender_id != user_id
+    )
+    if timestamp is not None:
+        query = query.where(Message.timestamp > timestamp)
+    return query.scalar_subquery()
+
+def bump_version(conversation_id):
+    """Mark everything cached for a conversation as stale, in the caller's transaction.
+
+    The increment happens in SQL so concurrent writers never end up on the same version.
+    """
+    ConversationSummary.query.filter_by(conversation_id=conversation_id).update({
+        ConversationSummary.version: ConversationSummary.version + 1
+    }, synchronize_session=False)
+
+def record_message(message, sender_name):
+    """Fold a new message into its conversation summary and unread counters.
+
+    Runs in the caller's transaction so the summary commits with the message.
+    """
+    summary = db.session.get(ConversationSummary, message.conversation_id)
+    if summary is None:
+        summary = ConversationSummary(conversation_id=message.conversation_id)
+        db.session.add(summary)
+
+    if summary.last_message_at is None or message.timestamp >= summary.last_message_at:
+        summary.last_message_id = message.id
+        summary.last_message_preview = message_preview(message.content, message.message_type, message.file_name)
+        summary.last_message_sender_id = message.sender_id
+        summary.last_message_sender_name = sender_name
+        summary.last_message_at = message.timestamp
+
+    # Everyone else has one more unread message
+    ConversationParticipant.query.filter(
+        ConversationParticipant.conversation_id == message.conversation_id,
+        ConversationParticipant.user_id != message.sender_id
+    ).update({
+        ConversationParticipant.unread_count: ConversationParticipant.unread_count + 1
+    }, synchronize_session=False)
+
+    # Sending a message means the sender has read everything before it
+    ConversationParticipant.query.filter_by(
+        conversation_id=message.conversation_id,
+        user_id=message.sender_id
+    ).update({
+        ConversationParticipant.last_read_message_id: message.id,
+        ConversationParticipant.last_read_at: message.timestamp,
+        ConversationParticipant.unread_count: 0
+    }, synchronize_session=False)
+    bump_version(message.conversation_id)
+
+def record_read(conversation_id, user_id, message_id, timestamp):
+    """Advance a participant's read watermark and recount their unread messages.
+
+    The watermark only moves forward; returns whether it moved. Runs in the
+    caller's transaction.
+    """
+    result = ConversationParticipant.query.filter(
+        ConversationParticipant.conversation_id == conversation_id,
+        ConversationParticipant.user_id == user_id,
+        or_(ConversationParticipant.last_read_at.is_(None), ConversationParticipant.last_read_at < timestamp)
+    ).update({
+        ConversationParticipant.last_read_message_id: message_id,
+        ConversationParticipant.last_read_at: timestamp,
+        ConversationParticipant.unread_count: unread_count_after(conversation_id, user_id, timestamp)
+    }, synchronize_session=False)
+    if result > 0:
+        # Seen ticks on the conversation's pages change
+        bump_version(conversation_id)
+    return result > 0
+
+def message_id_at(conversation_id, timestamp):
+    """Id of the message at a conversation position, for filling in watermarks"""
+    return db.session.query(Message.id).filter_by(
+        conversation_id=conversation_id,
+        timestamp=timestamp
+    ).order_by(Message.id.desc()).limit(1).scalar()
+
+def rebuild_summaries():
+    """Recompute every conversation summary and participant read state from scratch"""
+    # Versions only move forward, or responses cached under a reused version would come back
+    versions = dict(db.session.query(ConversationSummary.conversation_id, ConversationSummary.version))
+    ConversationSummary.query.delete()
+
+    # Last message per conversation
+    ranked = db.session.query(
+        Message,
+        func.row_number().over(
+            partition_by=Message.conversation_id,
+            order_by=(Message.timestamp.desc(), Message.id.desc())
+        ).label('rank')
+    ).subquery()
+    last_message = aliased(Message, ranked)
+    last_messages = {
+        message.conversation_id: (message, sender_name)
+        for message, sender_name in db.session.query(last_message, User.name).outerjoin(
+            User, User.user_id == last_message.sender_id
+        ).filter(ranked.c.rank == 1)
+    }
+
+    for (conversation_id,) in db.session.query(Conversation.id):
+        summary = ConversationSummary(conversation_id=conversation_id, version=versions.get(conversation_id, 0) + 1)
+        if conversation_id in last_messages:
+            message, sender_name = last_messages[conversation_id]
+            summary.last_message_id = message.id
+            summary.last_message_preview = message_preview(message.content, message.message_type, message.file_name)
+            summary.last_message_sender_id = message.sender_id
+            summary.last_message_sender_name = sender_name or 'Unknown'
+            summary.last_message_at = message.timestamp
+        db.session.add(summary)
+
+    # A participant has read at least up to the newest message they sent
+    last_sent = {
+        (conversation_id, user_id): timestamp
+        for conversation_id, user_id, timestamp in db.session.query(
+            Message.conversation_id, Message.sender_id, func.max(Message.timestamp)
+        ).group_by(Message.conversation_id, Message.sender_id)
+    }
+
+    participants = ConversationParticipant.query.all()
+    for participant in participants:
+        timestamp = last_sent.get((participant.conversation_id, participant.user_id))
+        if timestamp is not None and (participant.last_read_at is None or participant.last_read_at < timestamp):
+            participant.last_read_at = timestamp
+            participant.last_read_message_id = message_id_at(participant.conversation_id, timestamp)
+        participant.unread_count = db.session.query(
+            unread_count_after(participant.conversation_id, participant.user_id, participant.last_read_at)
+        ).scalar()
+
+    db.session.commit()
+    return len(participants)
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Rebuild conversation summaries and unread counters from existing data."""
+    participant_count = rebuild_summaries()
+    click.echo(f"Rebuilt summaries for {ConversationSummary.query.count()} conversations "
+               f"and {participant_count} participants")
+
+def collapse_receipts():
+    """Fold legacy per-message message_seen rows into read watermarks, then drop the table"""
+    if not inspect(db.engine).has_table('message_seen'):
+        return 0
+
+    newest_seen = db.session.execute(text(
+        "SELECT m.conversation_id, s.user_id, MAX(m.timestamp) "
+        "FROM message_seen s JOIN messages m ON m.id = s.message_id "
+        "GROUP BY m.conversation_id, s.user_id"
+    )).all()
+
+    for conversation_id, user_id, timestamp in newest_seen:
+        # Raw SQLite results come back as strings
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        record_read(conversation_id, user_id, message_id_at(conversation_id, timestamp), timestamp)
+
+    db.session.execute(text("DROP TABLE message_seen"))
+    db.session.commit()
+    return len(newest_seen)
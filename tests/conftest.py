@@ -0,0 +1,30 @@
+import os
+import sys
+import itertools
+import tempfile
+import pytest
+
+# A throwaway database, configured before the app module is imported
+test_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(test_dir, 'test.db')}"
+os.environ['JOB_RUNNER'] = 'inline'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+
+user_numbers = itertools.count()
+
+@pytest.fixture
+def register():
+    """Sign up a new user; returns their logged-in test client and User row"""
+    def register_user():
+        name = f"user{next(user_numbers)}"
+        client = app.test_client()
+        response = client.post('/api/register', json={'name': name, 'email': f"{name}@example.com"})
+        assert response.get_json()['success'], response.get_json()
+        with app.app_context():
+            user = User.query.filter_by(name=name).one()
+            db.session.expunge(user)
+        return client, user
+    return register_user
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+import routes
+from app import app, db
+
+# The inbox and message pages are polled constantly, so the number of queries
+# behind them must not grow with the number of conversations, members or
+# messages. Serialized responses are cached; the cache is bypassed here so
+# every request builds its payload from the database.
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    monkeypatch.setattr(routes, 'cache_get', lambda key: None)
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def inbox_queries(register, conversation_count):
+    """Queries behind /api/conversations for a user with this many conversations"""
+    client, user = register()
+    for index in range(conversation_count):
+        other_client, other = register()
+        conversation_id = client.post('/api/start_private_chat', json={'user_id': other.user_id}).get_json()['conversation_id']
+        # Alternate senders so the latest messages come from different users
+        sender = client if index % 2 else other_client
+        assert sender.post('/api/send_message', json={'conversation_id': conversation_id, 'content': f"hello {index}"}).get_json()['success']
+
+    client.get('/api/conversations')
+    with count_queries() as statements:
+        response = client.get('/api/conversations')
+    assert len(response.get_json()['conversations']) == conversation_count
+    return statements
+
+def message_page_queries(register, member_count, messages_per_member):
+    """Queries behind /api/messages for a group where every member has posted"""
+    members = [register() for _ in range(member_count)]
+    client, _ = members[0]
+    conversation_id = client.post('/api/create_group', json={
+        'name': 'group',
+        'members': [user.unique_id for _, user in members[1:]]
+    }).get_json()['conversation_id']
+    message_ids = []
+    for member_client, _ in members:
+        for index in range(messages_per_member):
+            response = member_client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': f"message {index}"})
+            message_ids.append(response.get_json()['message']['id'])
+    for member_client, _ in members[1:]:
+        member_client.post('/api/mark_seen', json={'message_ids': message_ids})
+
+    client.get(f"/api/messages/{conversation_id}")
+    with count_queries() as statements:
+        response = client.get(f"/api/messages/{conversation_id}")
+    assert len(response.get_json()['messages']) == member_count * messages_per_member
+    return statements
+
+def test_inbox_queries_do_not_grow_with_conversations(register):
+    few = inbox_queries(register, 3)
+    many = inbox_queries(register, 30)
+    assert len(many) == len(few), many
+
+def test_message_page_queries_do_not_grow_with_senders(register):
+    few = message_page_queries(register, 2, 2)
+    many = message_page_queries(register, 10, 5)
+    assert len(many) == len(few), many
@@ -0,0 +1,82 @@
+import io
+import shutil
+import hashlib
+import tempfile
+from storage import storage
+from blobs import BLOB_DIR
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are served at full size
+    Image = None
+
+# Longest edge in pixels for each variant served by /api/image/<id>?size=
+THUMBNAIL_SIZES = {'thumb': 320, 'preview': 1280}
+THUMBNAIL_DIR = '.thumbs'
+THUMBNAIL_QUALITY = 80
+# Animated GIFs and exotic formats keep their original
+THUMBNAIL_SOURCE_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/bmp', 'image/tiff'}
+# Larger sources are served as they are: rendering them would hold too much memory or CPU,
+# and this can run inside an /api/image request
+THUMBNAIL_MAX_SOURCE_BYTES = 50 * 1024 * 1024
+THUMBNAIL_MAX_SOURCE_PIXELS = 50 * 1000 * 1000
+# Object store bodies are spooled for seeking; beyond this they go to a temp file
+THUMBNAIL_SPOOL_MEMORY = 1024 * 1024
+
+def thumbnails_supported(file_type, file_size):
+    return (Image is not None and file_type in THUMBNAIL_SOURCE_TYPES
+            and (file_size or 0) <= THUMBNAIL_MAX_SOURCE_BYTES)
+
+def thumbnail_key(source_key, size):
+    """Variants are named after the source blob, so messages sharing an image share its thumbnails"""
+    if source_key.startswith(f"{BLOB_DIR}/"):
+        name = source_key.rsplit('/', 1)[-1]  # The content digest
+    else:
+        name = hashlib.sha256(source_key.encode()).hexdigest()  # Legacy name-based upload
+    return f"{THUMBNAIL_DIR}/{name}-{size}.webp"
+
+def delete_thumbnails(source_key):
+    """Remove every stored variant of an image, e.g. once its blob is collected"""
+    for size in THUMBNAIL_SIZES:
+        storage.delete(thumbnail_key(source_key, size))
+
+def generate_thumbnails(source_key, sizes=None):
+    """Store any missing WebP variants of an image; returns its displayed (width, height).
+
+    Images over THUMBNAIL_MAX_SOURCE_PIXELS only have their size read, no variants.
+    """
+    sizes = sorted(sizes or THUMBNAIL_SIZES, key=THUMBNAIL_SIZES.get, reverse=True)
+    missing = [size for size in sizes if not storage.exists(thumbnail_key(source_key, size))]
+
+    with storage.open(source_key) as source, tempfile.SpooledTemporaryFile(THUMBNAIL_SPOOL_MEMORY) as spool:
+        # Pillow needs to seek; object store bodies are copied out first
+        if not source.seekable():
+            shutil.copyfileobj(source, spool)
+            spool.seek(0)
+            source = spool
+        # Opening only parses the header, so the pixel count is known before anything is decoded
+        with Image.open(source) as image:
+            width, height = image.size
+            # EXIF orientations 5-8 are rotated a quarter turn
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            if missing and width * height <= THUMBNAIL_MAX_SOURCE_PIXELS:
+                render_thumbnails(image, source_key, missing)
+    return width, height
+
+def render_thumbnails(image, source_key, sizes):
+    """Downscale largest first, reusing each result for the next size"""
+    # Let the JPEG decoder scale down while decoding instead of inflating full resolution
+    largest = THUMBNAIL_SIZES[sizes[0]]
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    for size in sizes:
+        width = THUMBNAIL_SIZES[size]
+        image.thumbnail((width, width), Image.LANCZOS)
+        encoded = io.BytesIO()
+        image.save(encoded, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        encoded.seek(0)
+        storage.put_stream(thumbnail_key(source_key, size), encoded)